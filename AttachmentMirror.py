@@ -0,0 +1,68 @@
+import os
+import uuid
+import asyncio
+import hashlib
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_CONCURRENT = 3
+
+
+class LocalMirrorStore:
+    """
+    Filesystem stand-in for an object store: files are kept under their content hash
+    and served from base_url by whatever web server points at the directory.
+    """
+    def __init__(self, directory, base_url):
+        self.directory = directory
+        self.base_url = base_url.rstrip('/')
+        os.makedirs(directory, exist_ok=True)
+
+    def tempPath(self):
+        return os.path.join(self.directory, ".tmp-" + uuid.uuid4().hex)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.directory, key))
+
+    def put(self, tmp_path, key):
+        os.replace(tmp_path, os.path.join(self.directory, key))
+
+    def url(self, key):
+        return "{0}/{1}".format(self.base_url, key)
+
+
+class AttachmentMirror:
+    """
+    Copies attachments off the Discord CDN, whose links expire, into a durable store.
+    Files are streamed to disk while hashed, so identical uploads are kept once.
+    """
+    def __init__(self, store, max_concurrent=MAX_CONCURRENT):
+        self.store = store
+        self.max_concurrent = max_concurrent
+        self.semaphore = None
+
+    async def mirror(self, session, url, filename):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self.semaphore:
+            tmp_path = self.store.tempPath()
+            hasher = hashlib.sha256()
+            try:
+                async with session.get(url) as resp:
+                    resp.raise_for_status()
+                    with open(tmp_path, 'wb') as out_file:
+                        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                            hasher.update(chunk)
+                            out_file.write(chunk)
+
+                _, ext = os.path.splitext(filename)
+                key = hasher.hexdigest() + ext.lower()
+                if self.store.exists(key):
+                    os.remove(tmp_path)
+                else:
+                    self.store.put(tmp_path, key)
+                return self.store.url(key)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
@@ -0,0 +1,112 @@
+import asyncio
+import contextlib
+from collections import OrderedDict
+
+
+REACTION_CACHE_SIZE = 2000
+# how many survey threads may be handled at the same moment
+MAX_CONCURRENT_THREADS = 16
+
+
+class ReactionCache:
+    """
+    Bounded LRU of who reacted with which emoji, per message.
+    Kept current from gateway reaction events; reaction.users() is only paged on a miss.
+    """
+    def __init__(self, max_size=REACTION_CACHE_SIZE):
+        self.max_size = max_size
+        # message id -> {emoji: [set of user ids, whether the set is the full list]}
+        self.messages = OrderedDict()
+
+    def getEntry(self, msg_id, emoji):
+        emojis = self.messages.get(msg_id)
+        if emojis is None:
+            emojis = {}
+            self.messages[msg_id] = emojis
+            if len(self.messages) > self.max_size:
+                self.messages.popitem(last=False)
+        else:
+            self.messages.move_to_end(msg_id)
+        key = str(emoji)
+        entry = emojis.get(key)
+        if entry is None:
+            entry = [set(), False]
+            emojis[key] = entry
+        return entry
+
+    def add(self, msg_id, emoji, user_id):
+        self.getEntry(msg_id, emoji)[0].add(user_id)
+
+    def remove(self, msg_id, emoji, user_id):
+        self.getEntry(msg_id, emoji)[0].discard(user_id)
+
+    def seed(self, msg_id, emoji, user_ids):
+        entry = self.getEntry(msg_id, emoji)
+        # keep anything the gateway reported while the list was being fetched
+        entry[0].update(user_ids)
+        entry[1] = True
+
+    def clear(self, msg_id, emoji=None):
+        if emoji is None:
+            self.messages.pop(msg_id, None)
+        elif msg_id in self.messages:
+            self.messages[msg_id].pop(str(emoji), None)
+
+    def lookup(self, msg_id, emoji, user_id):
+        """
+        Returns True/False if the cache knows the answer, None if it has to be fetched.
+        """
+        emojis = self.messages.get(msg_id)
+        if emojis is None:
+            return None
+        self.messages.move_to_end(msg_id)
+        entry = emojis.get(str(emoji))
+        if entry is None:
+            return None
+        if user_id in entry[0]:
+            return True
+        if entry[1]:
+            return False
+        return None
+
+    async def hasUser(self, reaction, user_id):
+        found = self.lookup(reaction.message.id, reaction.emoji, user_id)
+        if found is not None:
+            return found
+
+        user_ids = set()
+        async for user in reaction.users():
+            user_ids.add(user.id)
+        self.seed(reaction.message.id, reaction.emoji, user_ids)
+        return user_id in user_ids
+
+
+class KeyedLocks:
+    """
+    Serializes work per key (a survey thread) while different keys run in parallel, up to a global cap.
+    A key's lock only exists while someone holds or waits on it.
+    """
+    def __init__(self, max_concurrent=MAX_CONCURRENT_THREADS):
+        self.max_concurrent = max_concurrent
+        # key -> [lock, holders and waiters]
+        self.locks = {}
+        self.semaphore = None
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = [asyncio.Lock(), 0]
+            self.locks[key] = entry
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # take a global slot only once it's this key's turn, so queued events don't hog slots
+                async with self.semaphore:
+                    yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[key]
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+
+
+# how often the loop thread's stack is sampled
+SAMPLE_INTERVAL = 0.005
+# a loop that has not run the heartbeat for this long is stalled
+STALL_THRESHOLD = 0.1
+HEARTBEAT_INTERVAL = 0.025
+DEFAULT_PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 300
+TOP_FUNCTIONS = 15
+TOP_STALLS = 5
+# the loop waiting on its selector is idle, not busy
+IDLE_FRAME = "selectors.py:select"
+
+
+def frameName(frame):
+    code = frame.f_code
+    return "{0}:{1}".format(os.path.basename(code.co_filename), code.co_name)
+
+
+def collapse(frame):
+    # root first, separated by ';', as flame graph tools expect
+    names = []
+    while frame is not None:
+        names.append(frameName(frame))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def taskName(task):
+    if task is None:
+        return "(plain callback)"
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", repr(coro))
+
+
+class SamplingProfiler:
+    """
+    Samples the event loop thread's stack from a side thread, so the loop itself runs untraced.
+    A heartbeat on the loop lets the side thread flag stalls over a threshold, with the stack
+    and task that were running when the loop stopped responding.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL, stall_threshold=STALL_THRESHOLD):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.running = False
+        self.seconds = 0
+        self.samples = 0
+        # collapsed stack -> samples
+        self.stacks = Counter()
+        # [seconds stalled, collapsed stack, task name]
+        self.stalls = []
+        self.last_beat = 0
+        self.loop_thread = None
+        self.stop_event = None
+
+    async def run(self, seconds):
+        loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.seconds = seconds
+        self.samples = 0
+        self.stacks = Counter()
+        self.stalls = []
+        self.last_beat = time.perf_counter()
+        self.stop_event = threading.Event()
+        sampler = threading.Thread(target=self.sample, args=(loop,), daemon=True)
+        self.running = True
+        sampler.start()
+        try:
+            end = loop.time() + seconds
+            while loop.time() < end:
+                self.last_beat = time.perf_counter()
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+        finally:
+            self.stop_event.set()
+            await loop.run_in_executor(None, sampler.join)
+            self.running = False
+
+    def sample(self, loop):
+        stall = None
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = collapse(frame)
+            self.stacks[stack] += 1
+            self.samples += 1
+
+            lag = time.perf_counter() - self.last_beat - HEARTBEAT_INTERVAL
+            if lag < self.stall_threshold:
+                stall = None
+            elif stall is None:
+                # the first sample of a stall is the code that is blocking the loop
+                stall = [lag, stack, taskName(asyncio.current_task(loop))]
+                self.stalls.append(stall)
+            else:
+                stall[0] = lag
+
+    def getFolded(self):
+        return "\n".join("{0} {1}".format(stack, count) for stack, count in self.stacks.most_common()) + "\n"
+
+    def getText(self):
+        busy = Counter()
+        for stack, count in self.stacks.items():
+            leaf = stack.split(";")[-1]
+            if leaf != IDLE_FRAME:
+                busy[leaf] += count
+        busy_samples = sum(busy.values())
+
+        text = "Profiled {0}s: {1} samples, {2:.0%} busy\n".format(
+            self.seconds, self.samples, busy_samples / self.samples if self.samples > 0 else 0)
+        text += "Top functions (self time while busy):\n"
+        for leaf, count in busy.most_common(TOP_FUNCTIONS):
+            text += "  {0:5.1%} {1}\n".format(count / busy_samples, leaf)
+        text += "Loop stalls over {0:.0f}ms: {1}\n".format(1000 * self.stall_threshold, len(self.stalls))
+        for seconds, stack, task in sorted(self.stalls, reverse=True)[:TOP_STALLS]:
+            text += "  {0:.0f}ms in {1} at {2}\n".format(1000 * seconds, task, " <- ".join(reversed(stack.split(";")[-3:])))
+        return text
@@ -0,0 +1,114 @@
+import time
+import bisect
+import contextlib
+from aiohttp import web
+
+
+# latency bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STATS_HOST = '127.0.0.1'
+
+
+class Histogram:
+
+    def __init__(self):
+        # one extra bucket for anything slower than the last bound
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds, error):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket the quantile falls in
+        target = q * self.count
+        seen = 0
+        for idx, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target and bucket_count > 0:
+                return BUCKETS[idx] if idx < len(BUCKETS) else float('inf')
+        return 0.0
+
+
+class BotStats:
+    """
+    Per-operation latency histograms, call and error counts, and gauges such as rate-limit headroom.
+    Recording is a clock read and a bucket increment, cheap enough for every event and API call.
+    """
+    def __init__(self):
+        self.ops = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def observe(self, name, seconds, error=False):
+        histogram = self.ops.get(name)
+        if histogram is None:
+            histogram = Histogram()
+            self.ops[name] = histogram
+        histogram.observe(seconds, error)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, error)
+
+    def setGauge(self, name, value):
+        self.gauges[name] = value
+
+    def getText(self):
+        text = "Up {0:.0f}s\n".format(time.time() - self.started)
+        for name in sorted(self.ops, key=lambda op: self.ops[op].total, reverse=True):
+            histogram = self.ops[name]
+            text += "{0}: n={1} err={2} mean={3:.1f}ms p50<={4}ms p99<={5}ms\n".format(
+                name, histogram.count, histogram.errors, 1000 * histogram.total / histogram.count,
+                1000 * histogram.quantile(0.5), 1000 * histogram.quantile(0.99))
+        for name in sorted(self.gauges):
+            text += "{0} = {1}\n".format(name, self.gauges[name])
+        return text
+
+    def getPrometheus(self):
+        lines = []
+        lines.append("# TYPE issuebot_op_seconds histogram")
+        for name in sorted(self.ops):
+            histogram = self.ops[name]
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for idx, bound in enumerate(BUCKETS):
+                cumulative += histogram.counts[idx]
+                lines.append('issuebot_op_seconds_bucket{{op="{0}",le="{1}"}} {2}'.format(label, bound, cumulative))
+            lines.append('issuebot_op_seconds_bucket{{op="{0}",le="+Inf"}} {1}'.format(label, histogram.count))
+            lines.append('issuebot_op_seconds_sum{{op="{0}"}} {1}'.format(label, histogram.total))
+            lines.append('issuebot_op_seconds_count{{op="{0}"}} {1}'.format(label, histogram.count))
+        lines.append("# TYPE issuebot_op_errors_total counter")
+        for name in sorted(self.ops):
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            lines.append('issuebot_op_errors_total{{op="{0}"}} {1}'.format(label, self.ops[name].errors))
+        for name in sorted(self.gauges):
+            lines.append("# TYPE issuebot_{0} gauge".format(name))
+            lines.append("issuebot_{0} {1}".format(name, self.gauges[name]))
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port):
+        async def metrics(request):
+            return web.Response(text=self.getPrometheus(), content_type='text/plain')
+
+        app = web.Application()
+        app.router.add_get('/metrics', metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        # localhost only; put a proxy in front if it needs to be reachable
+        await web.TCPSite(runner, STATS_HOST, port).start()
+        return runner
@@ -0,0 +1,324 @@
+import os
+import json
+import sqlite3
+import asyncio
+import threading
+import traceback
+
+
+# how long to wait for more changes before writing the config out
+FLUSH_DELAY = 2.0
+
+
+class JsonStore:
+    """
+    Write-behind persistence for config.json: changes are coalesced and written atomically off the event loop.
+    """
+    def __init__(self, path, get_dict, delay=FLUSH_DELAY):
+        self.path = path
+        self.get_dict = get_dict
+        self.delay = delay
+        self.dirty = False
+        self.flush_task = None
+        self.version = 0
+        self.written = 0
+        self.write_lock = threading.Lock()
+
+    def markDirty(self):
+        self.dirty = True
+        if self.flush_task is not None and not self.flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # no loop to flush from; the next flush() call will pick it up
+            return
+        self.flush_task = loop.create_task(self.flushLater())
+
+    async def flushLater(self):
+        # changes made while a write was in flight found this task still running, so pick them up here
+        while self.dirty:
+            await asyncio.sleep(self.delay)
+            await self.flushAsync()
+
+    async def flushAsync(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        # serialize on the loop so the writer thread never sees a half-updated config
+        version, text = self.serialize()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.write, version, text)
+        except Exception:
+            self.dirty = True
+            print(traceback.format_exc())
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        self.write(*self.serialize())
+
+    def serialize(self):
+        self.version += 1
+        return self.version, json.dumps(self.get_dict(), indent=2)
+
+    def write(self, version, text):
+        with self.write_lock:
+            # a newer snapshot may already have been written by a forced flush
+            if version <= self.written:
+                return
+            # other processes may be writing the same file
+            tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, 'w', encoding='utf-8') as txt:
+                txt.write(text)
+                txt.flush()
+                os.fsync(txt.fileno())
+            # rename is atomic, so a crash leaves either the old file or the new one
+            os.replace(tmp_path, self.path)
+            self.written = version
+
+
+class SqliteThreads:
+    """
+    Dict-like view of one guild's survey threads, backed by the threads table.
+    """
+    def __init__(self, store, guild_id, state_type):
+        self.store = store
+        self.guild_id = guild_id
+        self.state_type = state_type
+
+    def __contains__(self, thread_id):
+        row = self.store.conn.execute("SELECT 1 FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, thread_id):
+        row = self.store.conn.execute("SELECT reporter, step, prompt FROM threads WHERE thread_id = ?",
+                                      (thread_id,)).fetchone()
+        if row is None:
+            raise KeyError(thread_id)
+        return self.rowToState(row)
+
+    def __setitem__(self, thread_id, state):
+        if state is None:
+            row = (thread_id, self.guild_id, None, None, None)
+        else:
+            row = (thread_id, self.guild_id, state.reporter, state.step, state.prompt)
+        with self.store.conn:
+            self.store.conn.execute("INSERT OR REPLACE INTO threads (thread_id, guild_id, reporter, step, prompt) "
+                                    "VALUES (?, ?, ?, ?, ?)", row)
+
+    def __iter__(self):
+        rows = self.store.conn.execute("SELECT thread_id FROM threads WHERE guild_id = ?", (self.guild_id,)).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self.store.conn.execute("SELECT COUNT(*) FROM threads WHERE guild_id = ?", (self.guild_id,)).fetchone()[0]
+
+    def get(self, thread_id, default=None):
+        try:
+            return self[thread_id]
+        except KeyError:
+            return default
+
+    def pop(self, thread_id, default=None):
+        state = self.get(thread_id, default)
+        with self.store.conn:
+            self.store.conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+        return state
+
+    def rowToState(self, row):
+        # a thread with no reporter has to be rebuilt from history
+        if row[0] is None:
+            return None
+        return self.state_type({"reporter": row[0], "step": row[1], "prompt": row[2]})
+
+
+class SqliteIssues:
+    """
+    Dict-like view of one guild's pushed reports (message id -> issue), backed by the issues table.
+    """
+    def __init__(self, store, guild_id):
+        self.store = store
+        self.guild_id = guild_id
+
+    def __contains__(self, message_id):
+        row = self.store.conn.execute("SELECT 1 FROM issues WHERE message_id = ?", (message_id,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, message_id):
+        row = self.store.conn.execute("SELECT number, url FROM issues WHERE message_id = ?", (message_id,)).fetchone()
+        if row is None:
+            raise KeyError(message_id)
+        return { "number": row[0], "url": row[1] }
+
+    def __setitem__(self, message_id, issue):
+        with self.store.conn:
+            self.store.conn.execute("INSERT OR REPLACE INTO issues (message_id, guild_id, number, url) VALUES (?, ?, ?, ?)",
+                                    (message_id, self.guild_id, issue["number"], issue["url"]))
+
+    def __iter__(self):
+        rows = self.store.conn.execute("SELECT message_id FROM issues WHERE guild_id = ?", (self.guild_id,)).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self.store.conn.execute("SELECT COUNT(*) FROM issues WHERE guild_id = ?", (self.guild_id,)).fetchone()[0]
+
+    def get(self, message_id, default=None):
+        try:
+            return self[message_id]
+        except KeyError:
+            return default
+
+    def pop(self, message_id, default=None):
+        issue = self.get(message_id, default)
+        with self.store.conn:
+            self.store.conn.execute("DELETE FROM issues WHERE message_id = ?", (message_id,))
+        return issue
+
+
+class SqliteJsonMap:
+    """
+    Dict-like view of one guild's rows in a (key, guild_id, data) table, with JSON values.
+    """
+    def __init__(self, store, table, guild_id):
+        self.store = store
+        self.table = table
+        self.guild_id = guild_id
+
+    def __contains__(self, key):
+        row = self.store.conn.execute("SELECT 1 FROM {0} WHERE key = ?".format(self.table), (key,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, key):
+        row = self.store.conn.execute("SELECT data FROM {0} WHERE key = ?".format(self.table), (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value):
+        with self.store.conn:
+            self.store.conn.execute("INSERT OR REPLACE INTO {0} (key, guild_id, data) VALUES (?, ?, ?)".format(self.table),
+                                    (key, self.guild_id, json.dumps(value)))
+
+    def __iter__(self):
+        rows = self.store.conn.execute("SELECT key FROM {0} WHERE guild_id = ?".format(self.table),
+                                       (self.guild_id,)).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self.store.conn.execute("SELECT COUNT(*) FROM {0} WHERE guild_id = ?".format(self.table),
+                                       (self.guild_id,)).fetchone()[0]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        with self.store.conn:
+            self.store.conn.execute("DELETE FROM {0} WHERE key = ?".format(self.table), (key,))
+        return value
+
+
+class SqliteStore:
+    """
+    Optional SQLite backend for servers and survey threads, so they are not all held in config.json.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS servers (guild_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, guild_id TEXT NOT NULL, "
+                              "reporter INTEGER, step TEXT, prompt INTEGER)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS threads_guild ON threads (guild_id)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS issues (message_id TEXT PRIMARY KEY, guild_id TEXT NOT NULL, "
+                              "number INTEGER, url TEXT)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS issues_guild ON issues (guild_id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS issues_number ON issues (number)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS reports (key TEXT PRIMARY KEY, guild_id TEXT NOT NULL, data TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS reports_guild ON reports (guild_id)")
+
+    def close(self):
+        self.conn.close()
+
+    def getMeta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def setMeta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def migrate(self, servers):
+        """
+        One-shot import of the servers (and their threads) from an existing config.json.
+        """
+        if self.getMeta("migrated") is not None:
+            return False
+        with self.conn:
+            for guild_id in servers:
+                server_dict = dict(servers[guild_id])
+                threads = server_dict.pop("threads", {})
+                issues = server_dict.pop("issues", {})
+                reports = server_dict.pop("reports", {})
+                self.conn.execute("INSERT OR REPLACE INTO servers (guild_id, data) VALUES (?, ?)",
+                                  (guild_id, json.dumps(server_dict)))
+                # older configs only kept a list of thread ids
+                if isinstance(threads, list):
+                    threads = {str(thread_id): None for thread_id in threads}
+                for thread_id in threads:
+                    state = threads[thread_id]
+                    if state is None:
+                        state = {}
+                    self.conn.execute("INSERT OR REPLACE INTO threads (thread_id, guild_id, reporter, step, prompt) "
+                                      "VALUES (?, ?, ?, ?, ?)",
+                                      (thread_id, guild_id, state.get("reporter"), state.get("step"), state.get("prompt")))
+                for message_id in issues:
+                    self.conn.execute("INSERT OR REPLACE INTO issues (message_id, guild_id, number, url) VALUES (?, ?, ?, ?)",
+                                      (message_id, guild_id, issues[message_id]["number"], issues[message_id]["url"]))
+                for key in reports:
+                    self.conn.execute("INSERT OR REPLACE INTO reports (key, guild_id, data) VALUES (?, ?, ?)",
+                                      (key, guild_id, json.dumps(reports[key])))
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', '1')")
+        return True
+
+    def loadServers(self):
+        servers = {}
+        for guild_id, data in self.conn.execute("SELECT guild_id, data FROM servers"):
+            servers[guild_id] = json.loads(data)
+        return servers
+
+    def loadServer(self, guild_id):
+        row = self.conn.execute("SELECT data FROM servers WHERE guild_id = ?", (guild_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def findIssue(self, number):
+        # (guild id, report message id) of the report pushed as this issue, from any worker's guilds
+        row = self.conn.execute("SELECT guild_id, message_id FROM issues WHERE number = ?", (number,)).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def saveServers(self, servers):
+        with self.conn:
+            for guild_id in servers:
+                server_dict = dict(servers[guild_id])
+                server_dict.pop("threads", None)
+                server_dict.pop("issues", None)
+                server_dict.pop("reports", None)
+                self.conn.execute("INSERT OR REPLACE INTO servers (guild_id, data) VALUES (?, ?)",
+                                  (guild_id, json.dumps(server_dict)))
+
+    def threadMap(self, guild_id, state_type):
+        return SqliteThreads(self, guild_id, state_type)
+
+    def issueMap(self, guild_id):
+        return SqliteIssues(self, guild_id)
+
+    def reportMap(self, guild_id):
+        return SqliteJsonMap(self, "reports", guild_id)
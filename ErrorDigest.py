@@ -0,0 +1,81 @@
+import re
+import time
+import asyncio
+import hashlib
+import traceback
+from collections import OrderedDict
+
+
+# at most one digest goes out per window
+DIGEST_WINDOW = 60
+# and each digest is at most this many messages
+MAX_DIGEST_MESSAGES = 3
+MESSAGE_LIMIT = 1950
+
+FRAME_PATTERN = re.compile(r'^\s*File "([^"]+)", line (\d+), in (.+)$', re.MULTILINE)
+
+
+def fingerprint(trace):
+    # where it was raised and what was raised, ignoring the message text
+    frames = FRAME_PATTERN.findall(trace)
+    last_line = trace.strip().split('\n')[-1]
+    key = repr(frames) + last_line.split(':')[0]
+    return hashlib.sha1(key.encode()).hexdigest()[:8]
+
+
+class ErrorDigest:
+    """
+    Groups tracebacks by fingerprint and sends them as rate-limited digests with occurrence counts.
+    """
+    def __init__(self, get_target, window=DIGEST_WINDOW, max_messages=MAX_DIGEST_MESSAGES):
+        self.get_target = get_target
+        self.window = window
+        self.max_messages = max_messages
+        # fingerprint -> [first trace, occurrences]
+        self.pending = OrderedDict()
+        self.last_sent = 0
+        self.flush_task = None
+
+    def report(self, trace):
+        print(trace)
+        key = fingerprint(trace)
+        if key in self.pending:
+            self.pending[key][1] += 1
+        else:
+            self.pending[key] = [trace, 1]
+
+        if self.flush_task is None or self.flush_task.done():
+            delay = max(self.last_sent + self.window - time.time(), 0)
+            self.flush_task = asyncio.get_running_loop().create_task(self.flushLater(delay))
+
+    async def flushLater(self, delay):
+        await asyncio.sleep(delay)
+        try:
+            await self.flush()
+        except Exception:
+            # nowhere left to report it
+            print(traceback.format_exc())
+
+    def getMessages(self):
+        messages = []
+        skipped = 0
+        for key in self.pending:
+            trace, count = self.pending[key]
+            if len(messages) >= self.max_messages:
+                skipped += count
+                continue
+            header = "[{0}] x{1}\n".format(key, count)
+            messages.append("```" + header + trace[-(MESSAGE_LIMIT - len(header)):] + "```")
+        if skipped > 0:
+            messages.append("...and {0} more error(s) this window.".format(skipped))
+        return messages
+
+    async def flush(self):
+        if len(self.pending) == 0:
+            return
+        messages = self.getMessages()
+        self.pending = OrderedDict()
+        self.last_sent = time.time()
+        to_send = await self.get_target()
+        for content in messages:
+            await to_send.send(content)
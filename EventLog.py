@@ -0,0 +1,77 @@
+import json
+import time
+
+
+def attachmentDict(attachment):
+    return { "filename": attachment.filename, "url": attachment.url }
+
+
+def messageDict(msg):
+    reference = None
+    if msg.reference is not None:
+        reference = [msg.reference.channel_id, msg.reference.message_id]
+    return { "guild": msg.guild.id if msg.guild is not None else None,
+             "channel": msg.channel.id,
+             "parent": getattr(msg.channel, "parent_id", None),
+             "id": msg.id,
+             "author": msg.author.id,
+             "bot": msg.author.bot,
+             "content": msg.content,
+             "mentions": [user.id for user in msg.mentions],
+             "attachments": [attachmentDict(attachment) for attachment in msg.attachments],
+             "reference": reference }
+
+
+def payloadDict(payload):
+    event = { "guild": payload.guild_id,
+              "channel": payload.channel_id,
+              "message": payload.message_id }
+    user_id = getattr(payload, "user_id", None)
+    if user_id is not None:
+        event["user"] = user_id
+    emoji = getattr(payload, "emoji", None)
+    if emoji is not None:
+        event["emoji"] = str(emoji)
+    return event
+
+
+def eventDict(name, args):
+    """
+    Flattens a gateway event into plain ids and text, or None for events not worth replaying.
+    """
+    if name == "on_message":
+        return messageDict(args[0])
+    if name.startswith("on_raw_"):
+        return payloadDict(args[0])
+    return None
+
+
+class EventRecorder:
+    """
+    Appends gateway events to a JSONL file, one event per line, with their arrival time.
+    Message contents are recorded as-is; only point this at files the bot's operators may read.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def record(self, name, args):
+        event = eventDict(name, args)
+        if event is None:
+            return
+        event["event"] = name
+        event["time"] = time.time()
+        self.file.write(json.dumps(event) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def readEvents(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip() != "":
+                yield json.loads(line)
@@ -1,31 +1,135 @@
+import io
 import os
+import re
 import discord
 import traceback
 import json
 import git
 import sys
+import time
+import argparse
+import asyncio
 import IssueUtils
+import BotStore
+import BotCache
+import JobQueue
+import IssueIndex
+import LogAnalyzer
+import AttachmentMirror
+import Survey
+import ErrorDigest
+import BotStats
+import EventLog
+import BotProfiler
+import IssueStatus
+import aiohttp
+import importlib
 
 
 # Housekeeping for login information
 TOKEN_FILE_PATH = 'token.txt'
 CONFIG_FILE_PATH = 'config.json'
 PRIVATE_KEY_FILE_PATH = 'private-key.pem'
+ISSUE_INDEX_FILE_PATH = 'issue_index.json'
 
 scdir = os.path.dirname(os.path.abspath(__file__))
 
+# roles a channel can play in the routing table
+ROUTE_CHAT = "chat"
+ROUTE_ISSUE = "issue"
+ROUTE_THREAD = "thread"
+
+# how often the unresolved index is reconciled against the issue channel
+UNRESOLVED_RESCAN_INTERVAL = 6 * 60 * 60
+# how often the local issue index is brought up to date
+ISSUE_SYNC_INTERVAL = 10 * 60
+
+# settings that belong to one worker process, kept in the database instead of the shared config.json
+WORKER_KEYS = ["jobs", "update_ch", "update_msg"]
+
+# what the bot reacts to a report with: pushed, then closed as completed or as not planned
+PUSHED_EMOJI = '\U000021A9'
+CLOSED_EMOJI = '\U00002705'
+NOT_PLANNED_EMOJI = '\U0001F6AB'
+
 # The Discord client.
 intent = discord.Intents.default()
 intent.message_content = True
 client = discord.Client(intents=intent)
 
+STEP_PATTERN = re.compile(r"^(" + Survey.STEP_ID + r")\. ", re.MULTILINE)
+
+# reloaded in this order on update, so each one sees the new versions of those it imports
+RELOAD_MODULES = [JobQueue, BotCache, BotStats, BotStore, EventLog, BotProfiler, ErrorDigest,
+                  IssueUtils, IssueIndex, IssueStatus, LogAnalyzer, AttachmentMirror, Survey]
+GATEWAY_EVENTS = ["on_ready", "on_message", "on_raw_reaction_add", "on_raw_reaction_remove",
+                  "on_raw_reaction_clear", "on_raw_reaction_clear_emoji", "on_raw_message_delete"]
+
+def swapClasses(obj, modules, seen):
+    # point every object made from a reloaded module at the new class of the same name
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    if isinstance(obj, dict):
+        values = list(obj.values())
+    elif isinstance(obj, (list, tuple)):
+        values = list(obj)
+    else:
+        module = modules.get(type(obj).__module__)
+        if module is None:
+            return
+        new_type = getattr(module, type(obj).__name__, None)
+        if isinstance(new_type, type) and new_type is not type(obj):
+            obj.__class__ = new_type
+        values = list(getattr(obj, "__dict__", {}).values())
+    for value in values:
+        swapClasses(value, modules, seen)
+
+def parseShardRange(text):
+    # "3" or "0-3", inclusive
+    first, _, last = text.partition("-")
+    return list(range(int(first), int(last or first) + 1))
+
+def getStepPrefix(text):
+    # the question line of a survey prompt starts with its step, e.g. "3a. "
+    match = STEP_PATTERN.search(text)
+    if match is None:
+        return None
+    return match.group(1)
+
+class SurveyState:
+
+    def __init__(self, main_dict=None):
+        self.reporter = 0
+        self.step = ""
+        self.prompt = 0
+
+        if main_dict is None:
+            return
+
+        for key in main_dict:
+            self.__dict__[key] = main_dict[key]
+
+    def getDict(self):
+        return self.__dict__
+
 class BotServer:
 
     def __init__(self, main_dict=None):
         self.issue = 0
         self.chat = 0
         self.after_post = 0
-        self.threads = []
+        # ids of reports in the issue channel that nobody has responded to yet
+        self.unresolved = set()
+        self.unresolved_synced = False
+        # thread id -> SurveyState, or None if it must be rebuilt from history
+        self.threads = {}
+        # report message id -> { number, url } of the issue it was pushed as
+        self.issues = {}
+        # report message id -> extra findings for its issue, such as the log summary
+        self.reports = {}
+        # survey definition for this server; the default survey is used if empty
+        self.survey = {}
         self.prefix = ""
 
         if main_dict is None:
@@ -34,8 +138,38 @@ class BotServer:
         for key in main_dict:
             self.__dict__[key] = main_dict[key]
 
+        self.unresolved = set(self.unresolved)
+
+        sub_dict = {}
+        # older configs only kept a list of thread ids
+        if isinstance(self.threads, list):
+            for thread_id in self.threads:
+                sub_dict[str(thread_id)] = None
+        else:
+            for key in self.threads:
+                state = self.threads[key]
+                sub_dict[key] = SurveyState(state) if state is not None else None
+        self.threads = sub_dict
+
     def getDict(self):
-        return self.__dict__
+        node_dict = { }
+        for k in self.__dict__:
+            node_dict[k] = self.__dict__[k]
+        node_dict["unresolved"] = sorted(self.unresolved)
+        # threads and issues kept in a database are saved by the database itself
+        if not isinstance(self.issues, dict):
+            del node_dict["issues"]
+        if not isinstance(self.reports, dict):
+            del node_dict["reports"]
+        if not isinstance(self.threads, dict):
+            del node_dict["threads"]
+            return node_dict
+        sub_dict = { }
+        for sub_idx in self.threads:
+            state = self.threads[sub_idx]
+            sub_dict[sub_idx] = state.getDict() if state is not None else None
+        node_dict["threads"] = sub_dict
+        return node_dict
 
 class BotConfig:
 
@@ -46,8 +180,31 @@ class BotConfig:
         self.update_msg = 0
         self.repo_owner = ""
         self.repo_name = ""
+        self.api_url = IssueUtils.API_URL
         self.app_id = ""
         self.install_id = ""
+        # optional SQLite database for servers and threads; config.json is used alone if empty
+        self.db_path = ""
+        # outbound calls still waiting to go through
+        self.jobs = []
+        # how much of an attached log is read when summarizing it
+        self.log_byte_cap = LogAnalyzer.LOG_BYTE_CAP
+        # errors are sent as one digest per window, of at most this many messages
+        self.error_window = ErrorDigest.DIGEST_WINDOW
+        self.error_max_messages = ErrorDigest.MAX_DIGEST_MESSAGES
+        # localhost port for the Prometheus metrics endpoint; disabled if 0
+        self.stats_port = 0
+        # JSONL file that incoming events are recorded to for replay; disabled if empty
+        self.record_path = ""
+        # update swaps in the new code under the live connection, restarting only if that fails
+        self.hot_reload = True
+        # GitHub webhook deliveries for issue status; disabled if 0.  The secret must match the webhook's.
+        self.webhook_port = 0
+        self.webhook_host = "127.0.0.1"
+        self.webhook_secret = ""
+        # where attachments are copied so issues don't link expiring CDN urls; disabled if empty
+        self.mirror_dir = ""
+        self.mirror_url = ""
         self.servers = {}
 
         if main_dict is None:
@@ -71,27 +228,177 @@ class BotConfig:
         node_dict["servers"] = sub_dict
         return node_dict
 
+class BotCommand:
+
+    def __init__(self, name, handler, desc, usage="", staff=False, root=False):
+        self.name = name
+        self.handler = handler
+        self.desc = desc
+        self.usage = usage
+        # staff commands need isAuthorized, root commands need the root user
+        self.staff = staff
+        self.root = root
+
 class IssueBot:
     """
     A class for handling issues
     """
-    def __init__(self, in_path, client):
+    def __init__(self, in_path, client, shard_count=0, shard_ids=None):
         # init data
         self.path = in_path
         self.need_restart = False
         with open(os.path.join(self.path, CONFIG_FILE_PATH)) as f:
             self.config = BotConfig(json.load(f))
-        self.private_key = open(PRIVATE_KEY_FILE_PATH, 'r').read()
-
+        # a process running only some of the shards keeps only their guilds
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+        self.worker = None
+        if shard_ids is not None:
+            if self.config.db_path == "":
+                raise Exception("Running a subset of the shards needs db_path, so servers are shared between processes.")
+            self.worker = "worker:" + ",".join(str(shard_id) for shard_id in shard_ids)
+        self.store = BotStore.JsonStore(os.path.join(self.path, CONFIG_FILE_PATH), self.getConfigDict)
+        self.db = None
+        if self.config.db_path != "":
+            self.openDatabase()
+        self.buildRoutes()
+        self.private_key = open(os.path.join(self.path, PRIVATE_KEY_FILE_PATH), 'r').read()
+        self.credentials = IssueUtils.AppCredentials(self.private_key, self.config.app_id, self.config.install_id)
+        self.github = IssueUtils.GithubClient(self.credentials, self.config.repo_owner, self.config.repo_name, self.config.api_url)
+        self.started = False
+        self.stats = BotStats.BotStats()
+        self.profiler = BotProfiler.SamplingProfiler()
+        self.profile_task = None
+        self.recorder = None
+        if self.config.record_path != "":
+            self.recorder = EventLog.EventRecorder(os.path.join(self.path, self.config.record_path))
+        self.github.stats = self.stats
+        self.errors = ErrorDigest.ErrorDigest(self.getErrorTarget, self.config.error_window, self.config.error_max_messages)
+        self.error_target = None
+        self.jobs = JobQueue.JobQueue(self.config.jobs, self.saveConfig, self.sendError)
+        self.issue_index = IssueIndex.IssueIndex(os.path.join(self.path, ISSUE_INDEX_FILE_PATH))
+        self.issue_index.load()
+        self.log_analyzer = LogAnalyzer.LogAnalyzer(self.config.log_byte_cap)
+        self.mirror = None
+        if self.config.mirror_dir != "":
+            store = AttachmentMirror.LocalMirrorStore(os.path.join(self.path, self.config.mirror_dir), self.config.mirror_url)
+            self.mirror = AttachmentMirror.AttachmentMirror(store)
+        self.downloads = None
+        self.reactions = BotCache.ReactionCache()
+        self.thread_locks = BotCache.KeyedLocks()
+        # guild id -> { report id: whether it became unresolved } for changes made during a rescan
+        self.rescans = {}
+        # attachment work started by surveys that is still running
+        self.background = set()
+        # guild id -> CompiledSurvey
+        self.surveys = {}
+        self.webhooks = IssueStatus.WebhookReceiver(self.config.webhook_secret, self.handleWebhook, self.sendError)
+        self.dropStaleClaims()
+        self.buildIssueReports()
+        self.bindHandlers()
 
         self.client = client
+        self.instrumentDiscord()
 
         print("Info Initiated")
 
+    def bindHandlers(self):
+        # everything that holds on to one of the bot's methods; redone after a hot reload
+        self.handlers = { ROUTE_CHAT: self.handleChat, ROUTE_ISSUE: self.handleIssue, ROUTE_THREAD: self.handleThread }
+        self.registerCommands()
+        self.store.get_dict = self.getConfigDict
+        self.errors.get_target = self.getErrorTarget
+        self.jobs.save = self.saveConfig
+        self.jobs.report_error = self.sendError
+        self.jobs.register("create_issue", self.runCreateIssue, self.releaseIssue)
+        self.jobs.register("react", self.runReact)
+        self.webhooks.handle = self.handleWebhook
+        self.webhooks.report_error = self.sendError
+
+    def openDatabase(self):
+        self.db = BotStore.SqliteStore(os.path.join(self.path, self.config.db_path))
+        if self.db.migrate(self.config.getDict()["servers"]):
+            print("Migrated servers from config.json")
+            # servers now live in the database, so drop them from config.json
+            self.saveConfig()
+        self.config.servers = {}
+        server_dicts = self.db.loadServers()
+        for guild_id in server_dicts:
+            if self.ownsGuild(guild_id):
+                self.addServer(guild_id, BotServer(server_dicts[guild_id]))
+
+        if self.worker is not None:
+            saved = self.db.getMeta(self.worker)
+            if saved is not None:
+                for key, value in json.loads(saved).items():
+                    self.config.__dict__[key] = value
+            elif 0 not in self.shard_ids:
+                # jobs left in config.json by an unsharded run go to the worker with shard 0
+                self.config.jobs = []
+
+    def ownsGuild(self, guild_id):
+        if self.shard_ids is None:
+            return True
+        # Discord sends a guild's events to shard (guild_id >> 22) % shard_count
+        return (int(guild_id) >> 22) % self.shard_count in self.shard_ids
+
+    def addServer(self, guild_id_str, server):
+        if self.db is not None:
+            self.attachDatabase(guild_id_str, server)
+        self.config.servers[guild_id_str] = server
+
+    def attachDatabase(self, guild_id_str, server):
+        server.threads = self.db.threadMap(guild_id_str, SurveyState)
+        server.issues = self.db.issueMap(guild_id_str)
+        server.reports = self.db.reportMap(guild_id_str)
+
+    def buildRoutes(self):
+        # channel id -> (guild id string, role); threads are added as they are seen
+        routes = {}
+        for guild_id_str in self.config.servers:
+            server = self.config.servers[guild_id_str]
+            routes[server.chat] = (guild_id_str, ROUTE_CHAT)
+            routes[server.issue] = (guild_id_str, ROUTE_ISSUE)
+        self.routes = routes
+
+    def getRoute(self, channel_id):
+        route = self.routes.get(channel_id)
+        if route is not None:
+            return route
+
+        # only threads under an issue channel are routed; the channel cache answers without a request
+        channel = self.client.get_channel(channel_id)
+        parent_route = self.routes.get(getattr(channel, "parent_id", None))
+        if parent_route is None or parent_route[1] != ROUTE_ISSUE:
+            return None
+        route = (parent_route[0], ROUTE_THREAD)
+        self.routes[channel_id] = route
+        return route
+
+    def getDownloadSession(self):
+        # attachments come from the Discord CDN, so they get their own pool
+        if self.downloads is None or self.downloads.closed:
+            self.downloads = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(sock_read=IssueUtils.REQUEST_TIMEOUT))
+        return self.downloads
+
+    def getConfigDict(self):
+        config = self.config.getDict()
+        if self.db is not None:
+            # servers and their threads live in the database
+            self.db.saveServers(config.pop("servers"))
+        if self.worker is not None:
+            # every worker writes the same config.json, so what differs between them goes in the database
+            self.db.setMeta(self.worker, json.dumps({ key: config.pop(key) for key in WORKER_KEYS }))
+        return config
+
     def saveConfig(self):
-        with open(os.path.join(self.path, CONFIG_FILE_PATH), 'w', encoding='utf-8') as txt:
-            config = self.config.getDict()
-            json.dump(config, txt, indent=2)
+        self.store.markDirty()
+
+    def flushConfig(self):
+        self.store.flush()
+        self.issue_index.store.flush()
+        if self.recorder is not None:
+            self.recorder.flush()
 
     async def updateBot(self, msg):
         resp_ch = self.getChatChannel(msg.guild.id)
@@ -99,13 +406,109 @@ class IssueBot:
         # update self
         bot_repo = git.Repo(scdir)
         origin = bot_repo.remotes.origin
-        origin.pull()
+        await self.client.loop.run_in_executor(None, origin.pull)
+        if self.config.hot_reload:
+            try:
+                start = time.perf_counter()
+                self.reloadCode()
+                await resp.edit(content="Update complete! Reloaded in {0:.0f}ms.".format(1000 * (time.perf_counter() - start)))
+                return
+            except Exception as e:
+                await self.sendError(traceback.format_exc())
+        await self.restartBot(resp_ch, resp)
+
+    def reloadCode(self):
+        # helpers first, in import order, so each one picks up the reloaded versions of the ones before it
+        modules = {}
+        for module in RELOAD_MODULES:
+            modules[module.__name__] = importlib.reload(module)
+        # this file usually runs as __main__, so the first reload imports it under its own name
+        if "IssueBot" in sys.modules:
+            bot_module = importlib.reload(sys.modules["IssueBot"])
+        else:
+            bot_module = importlib.import_module("IssueBot")
+        modules["IssueBot"] = bot_module
+        modules[type(self).__module__] = bot_module
+
+        # live objects keep their state and take on the new code
+        swapClasses(self, modules, set())
+        # settings added by the new code start at their defaults
+        for obj in [self.config] + list(self.config.servers.values()):
+            for key, value in vars(type(obj)()).items():
+                obj.__dict__.setdefault(key, value)
+        self.surveys = {}
+        if self.db is not None:
+            for guild_id_str in self.config.servers:
+                self.addServer(guild_id_str, self.config.servers[guild_id_str])
+        self.bindHandlers()
+
+        # the new module's event handlers take over the live connection
+        bot_module.client = self.client
+        bot_module.issue_bot = self
+        for name in GATEWAY_EVENTS:
+            self.client.event(getattr(bot_module, name))
+
+    async def restartBot(self, resp_ch, resp):
         await resp.edit(content="Update complete! Bot will restart.")
         self.need_restart = True
         self.config.update_ch = resp_ch.id
         self.config.update_msg = resp.id
         self.saveConfig()
-        await self.client.logout()
+        self.flushConfig()
+        await self.github.close()
+        if self.downloads is not None:
+            await self.downloads.close()
+        await self.client.close()
+
+    def instrumentDiscord(self):
+        # every REST call discord.py makes goes through HTTPClient.request, keyed by its route template
+        request = self.client.http.request
+        async def timed_request(route, **kwargs):
+            with self.stats.timed("discord {0} {1}".format(route.method, route.path)):
+                return await request(route, **kwargs)
+        self.client.http.request = timed_request
+
+    async def showStats(self, msg, args):
+        await msg.channel.send(msg.author.mention + "\n```" + self.stats.getText()[:1900] + "```")
+
+    async def profileBot(self, msg, args):
+        if self.profile_task is not None and not self.profile_task.done():
+            await msg.channel.send(msg.author.mention + " A profile is already running.")
+            return
+        seconds = BotProfiler.DEFAULT_PROFILE_SECONDS
+        if len(args) > 0 and args[0].isdigit():
+            seconds = min(max(int(args[0]), 1), BotProfiler.MAX_PROFILE_SECONDS)
+        await msg.channel.send(msg.author.mention + " Profiling for {0}s, results go to the error channel.".format(seconds))
+        # the command returns now; the profile runs alongside everything else
+        self.profile_task = self.client.loop.create_task(self.runProfile(seconds))
+
+    async def runProfile(self, seconds):
+        try:
+            await self.profiler.run(seconds)
+            folded = discord.File(io.BytesIO(self.profiler.getFolded().encode()), filename="profile.folded")
+            to_send = await self.getErrorTarget()
+            await to_send.send("```" + self.profiler.getText()[:1900] + "```", file=folded)
+        except Exception as e:
+            await self.sendError(traceback.format_exc())
+
+    def startBackgroundTasks(self):
+        # on_ready fires again on every reconnect
+        if self.started:
+            return
+        self.started = True
+        self.client.loop.create_task(self.github.keep_fresh())
+        self.jobs.start()
+        # workers on one host each need their own port, and GitHub delivers webhooks to just one
+        first_shard = min(self.shard_ids) if self.shard_ids is not None else 0
+        if self.config.stats_port != 0:
+            self.client.loop.create_task(self.stats.serve(self.config.stats_port + first_shard))
+        self.client.loop.create_task(self.reconcileUnresolved())
+        self.client.loop.create_task(self.syncIssueIndex())
+        if self.config.webhook_port != 0 and first_shard == 0:
+            if self.config.webhook_secret == "":
+                print("webhook_secret is not set; not starting the webhook receiver")
+            else:
+                self.client.loop.create_task(self.webhooks.serve(self.config.webhook_host, self.config.webhook_port))
 
     async def checkRestarted(self):
         if self.config.update_ch != 0 and self.config.update_msg != 0:
@@ -116,12 +519,17 @@ class IssueBot:
             self.saveConfig()
 
     async def sendError(self, trace):
-        print(trace)
-        to_send = await self.client.fetch_user(self.config.root)
-        if self.config.error_ch != 0:
-            to_send = self.client.get_channel(self.config.error_ch)
-
-        await to_send.send("```" + trace[:1950] + "```")
+        self.stats.observe("errors", 0, True)
+        self.errors.report(trace)
+
+    async def getErrorTarget(self):
+        # resolved once; fetching the root user is a REST call
+        if self.error_target is None:
+            if self.config.error_ch != 0:
+                self.error_target = self.client.get_channel(self.config.error_ch)
+            else:
+                self.error_target = await self.client.fetch_user(self.config.root)
+        return self.error_target
 
     def getChatChannel(self, guild_id):
         chat_id = self.config.servers[str(guild_id)].chat
@@ -137,67 +545,414 @@ class IssueBot:
 
         return False
 
-    async def respondInvalid(self, issue_reporter, msg):
-        if msg.author.id == issue_reporter:
-            await msg.add_reaction('\U0000274C')
-        else:
-            remove_users = []
-            for reaction in msg.reactions:
-                async for user in reaction.users():
-                    if user.id == issue_reporter:
-                        remove_users.append((reaction, user))
-
-            for reaction, user in remove_users:
-                await reaction.remove(user)
-
-    async def pushIssue(self, msg, labels):
-        args = msg.content.split(' ')
-        title = " ".join(args[1:])
-        issue_msg = await self.client.get_channel(msg.reference.channel_id).fetch_message(msg.reference.message_id)
-        await msg.delete()
-        # push issue to git
-        header = IssueUtils.get_access_token_header(self.private_key, self.config.app_id, self.config.install_id)
+    async def getAttachmentUrl(self, attachment):
+        if self.mirror is None:
+            return attachment.url
+        return await self.mirror.mirror(self.getDownloadSession(), attachment.url, attachment.filename)
+
+    async def getIssueBody(self, issue_msg):
         body = "Discord: {0}#{1} {2}".format(issue_msg.author.name, issue_msg.author.discriminator,
                                               issue_msg.author.mention)
         body += "\n\n"
         body += issue_msg.content
-        for attachment in issue_msg.attachments:
-            body += "\n![image]({0})".format(attachment.url)
+        urls = await asyncio.gather(*[self.getAttachmentUrl(attachment) for attachment in issue_msg.attachments])
+        for url in urls:
+            body += "\n![image]({0})".format(url)
+        report = self.config.servers[str(issue_msg.guild.id)].reports.get(str(issue_msg.id), {})
+        for file in report.get("files", []):
+            body += "\n[{0}]({1})".format(file["name"], file["url"])
+        if "log" in report:
+            body += "\n\n**Log summary**\n```\n{0}\n```".format(report["log"])
+        return body
+
+    async def pushIssue(self, msg, title, labels):
+        issue_msg = await self.client.get_channel(msg.reference.channel_id).fetch_message(msg.reference.message_id)
+        server = self.config.servers[str(issue_msg.guild.id)]
+        existing = server.issues.get(str(issue_msg.id))
+        if existing is not None:
+            await msg.delete()
+            await msg.channel.send(msg.author.mention + " Already pushed: {0}".format(self.describeIssue(existing)))
+            return
+        # claim the report before anything is awaited, so a second push is refused from here on
+        server.issues[str(issue_msg.id)] = { "number": None, "url": None }
+        try:
+            body = await self.getIssueBody(issue_msg)
+        except Exception:
+            server.issues.pop(str(issue_msg.id), None)
+            raise
+
+        # push issue to git in the background; the job is retried until it goes through
+        self.jobs.enqueue("create_issue", { "guild": issue_msg.guild.id, "channel": issue_msg.channel.id,
+                                            "message": issue_msg.id, "title": title, "body": body, "labels": labels })
+        # only drop the command once the job is safely on disk
+        await self.store.flushAsync()
+        await msg.delete()
 
-        url = IssueUtils.create_issue(header, self.config.repo_owner, self.config.repo_name, title, body, labels)
+    async def bulkPush(self, msg, args):
+        server = self.config.servers[str(msg.guild.id)]
+        labels = []
+        refs = []
+        for arg in args:
+            if arg == "":
+                continue
+            # message links carry their channel; bare ids are taken from the issue channel
+            link = arg.strip('<>').split('/')
+            if link[-1].isdigit():
+                ch_id = int(link[-2]) if len(link) > 2 and link[-2].isdigit() else server.issue
+                refs.append((ch_id, int(link[-1])))
+            else:
+                labels.append(arg)
+
+        if len(refs) == 0:
+            await msg.channel.send(msg.author.mention + " No reports given!")
+            return
+
+        summary = ""
+        found = []
+        for ch_id, msg_id in refs:
+            channel = self.client.get_channel(ch_id)
+            if channel is None:
+                summary += "\n{0}: unknown channel {1}".format(msg_id, ch_id)
+            else:
+                found.append((channel, msg_id))
+
+        fetched = await asyncio.gather(*[channel.fetch_message(msg_id) for channel, msg_id in found], return_exceptions=True)
+        issue_msgs = []
+        for (channel, msg_id), issue_msg in zip(found, fetched):
+            if isinstance(issue_msg, Exception):
+                summary += "\n{0}: could not fetch ({1})".format(msg_id, issue_msg)
+            elif issue_msg.guild is None or issue_msg.guild.id != msg.guild.id:
+                # reports are recorded under their own server, so only this one's can be pushed from here
+                summary += "\n{0}: not a report in this server".format(msg_id)
+            elif str(msg_id) in server.issues:
+                summary += "\n{0}: already pushed as {1}".format(msg_id, self.describeIssue(server.issues[str(msg_id)]))
+            else:
+                # claimed before anything is awaited, like a single push
+                server.issues[str(msg_id)] = { "number": None, "url": None }
+                issue_msgs.append(issue_msg)
+
+        if len(issue_msgs) > 0:
+            try:
+                unknown = await self.github.missing_labels(labels)
+                if len(unknown) > 0:
+                    summary += "\nUnknown labels, left off: {0}".format(", ".join(unknown))
+                bodies = await asyncio.gather(*[self.getIssueBody(issue_msg) for issue_msg in issue_msgs])
+                issues = [(issue_msg.content.split('\n')[0][:100], body, labels) for issue_msg, body in zip(issue_msgs, bodies)]
+                results = await self.github.create_issues(issues)
+            except Exception as e:
+                for issue_msg in issue_msgs:
+                    server.issues.pop(str(issue_msg.id), None)
+                if isinstance(e, JobQueue.RetryLater):
+                    await msg.channel.send(msg.author.mention + " GitHub is rate limiting us, try again in {0:.0f}s.".format(e.delay))
+                    return
+                raise
+
+            for issue_msg, created in zip(issue_msgs, results):
+                if created is None:
+                    server.issues.pop(str(issue_msg.id), None)
+                    summary += "\n{0}: failed".format(issue_msg.id)
+                    continue
+                self.recordIssue(issue_msg.guild.id, issue_msg.channel.id, issue_msg.id, created["number"], created["url"])
+                summary += "\n{0}: {1}".format(issue_msg.id, self.describeIssue(created))
+                self.jobs.enqueue("react", { "channel": issue_msg.channel.id, "message": issue_msg.id, "emoji": PUSHED_EMOJI })
+                self.resolveReport(issue_msg.guild.id, issue_msg.id)
+
+        self.saveConfig()
+        await msg.channel.send((msg.author.mention + " **Bulk push**" + summary)[:1950])
+
+    def describeIssue(self, issue):
+        if issue["number"] is None:
+            return "issue creation is pending"
+        return "#{0} {1}".format(issue["number"], issue["url"])
+
+    async def lookupIssue(self, msg, args):
+        if len(args) == 0 or not args[0].strip('<>').split('/')[-1].isdigit():
+            await msg.channel.send(msg.author.mention + " Give a message link or id!")
+            return
+        msg_id = args[0].strip('<>').split('/')[-1]
+        issue = self.config.servers[str(msg.guild.id)].issues.get(msg_id)
+        if issue is None:
+            await msg.channel.send(msg.author.mention + " That report has not been pushed.")
+        else:
+            await msg.channel.send(msg.author.mention + " {0}".format(self.describeIssue(issue)))
+
+    async def runCreateIssue(self, args):
+        server = self.config.servers[str(args["guild"])]
+        issue = server.issues.get(str(args["message"]))
+        # a retried job must not file the issue a second time
+        if issue is None or issue["number"] is None:
+            resp_json = await self.github.create_issue(args["title"], args["body"], args["labels"])
+            self.recordIssue(args["guild"], args["channel"], args["message"], resp_json["number"], resp_json["html_url"])
+            self.saveConfig()
         # react with a star... and a reply?
-        await issue_msg.add_reaction('\U000021A9')
+        self.jobs.enqueue("react", { "channel": args["channel"], "message": args["message"], "emoji": PUSHED_EMOJI })
+        self.resolveReport(args["guild"], args["message"])
+
+    def recordIssue(self, guild_id, channel_id, msg_id, number, url):
+        server = self.config.servers[str(guild_id)]
+        server.issues[str(msg_id)] = { "number": number, "url": url }
+        # the report may have been linked from outside the issue channel
+        report = server.reports.get(str(msg_id), {})
+        report["channel"] = channel_id
+        server.reports[str(msg_id)] = report
+        self.issue_reports[number] = (str(guild_id), str(msg_id))
+
+    def dropStaleClaims(self):
+        # a push claims its report before the issue exists; without a job to finish it, the claim outlived a crash
+        pending = set()
+        for job in self.config.jobs:
+            if job["kind"] == "create_issue":
+                pending.add((str(job["args"]["guild"]), str(job["args"]["message"])))
+        for guild_id_str in self.config.servers:
+            issues = self.config.servers[guild_id_str].issues
+            stale = [msg_id for msg_id in issues if issues.get(msg_id)["number"] is None and (guild_id_str, msg_id) not in pending]
+            for msg_id in stale:
+                issues.pop(msg_id, None)
+            if len(stale) > 0:
+                self.saveConfig()
+
+    def buildIssueReports(self):
+        # issue number -> (guild id string, report message id string), to find a report from GitHub's side
+        self.issue_reports = {}
+        for guild_id_str in self.config.servers:
+            issues = self.config.servers[guild_id_str].issues
+            for msg_id in issues:
+                issue = issues.get(msg_id)
+                if issue is not None and issue["number"] is not None:
+                    self.issue_reports[issue["number"]] = (guild_id_str, msg_id)
+
+    def findReport(self, number):
+        # only one worker receives webhooks, so the report may be in a guild another worker owns
+        found = self.issue_reports.get(number)
+        if found is None and self.db is not None:
+            found = self.db.findIssue(number)
+        if found is None:
+            return None
+        guild_id_str, msg_id = found
+        server = self.config.servers.get(guild_id_str)
+        if server is None:
+            server_dict = self.db.loadServer(guild_id_str)
+            if server_dict is None:
+                return None
+            server = BotServer(server_dict)
+            self.attachDatabase(guild_id_str, server)
+        return server, msg_id
+
+    async def handleWebhook(self, event, payload):
+        if event == "issues":
+            await self.applyIssueStatus(payload["issue"])
+        elif event == "pull_request":
+            await self.applyPullRequest(payload["pull_request"])
+
+    async def applyIssueStatus(self, issue_json):
+        found = self.findReport(issue_json["number"])
+        if found is None:
+            return
+        server, msg_id = found
+        # the webhook and the poller can both see the same change
+        async with self.thread_locks.hold(int(msg_id)):
+            report = server.reports.get(msg_id, {})
+            old = report.get("status")
+            new = IssueStatus.issue_status(issue_json)
+            if old == new:
+                return
+            report["status"] = new
+            server.reports[msg_id] = report
+            self.saveConfig()
+
+            # the first status seen is only news if the issue is already closed
+            if old is None:
+                old = { "state": "open", "reason": None, "labels": new["labels"] }
+            changes = []
+            if new["state"] != old["state"] or new["reason"] != old["reason"]:
+                await self.markReportState(server, msg_id, report, new)
+                if new["state"] == "closed":
+                    changes.append("closed as {0}".format((new["reason"] or "completed").replace("_", " ")))
+                else:
+                    changes.append("reopened")
+            labels = ["+" + label for label in new["labels"] if label not in old["labels"]]
+            labels += ["-" + label for label in old["labels"] if label not in new["labels"]]
+            if len(labels) > 0:
+                changes.append("labels " + " ".join(labels))
+            if len(changes) > 0:
+                await self.postToReportThread(msg_id, "**Issue #{0}**: {1}".format(issue_json["number"], ", ".join(changes)))
+
+    async def applyPullRequest(self, pull_json):
+        state = IssueStatus.pull_state(pull_json)
+        for number in IssueStatus.closing_refs(pull_json.get("body"), self.config.repo_owner + "/" + self.config.repo_name):
+            found = self.findReport(number)
+            if found is None:
+                continue
+            server, msg_id = found
+            async with self.thread_locks.hold(int(msg_id)):
+                report = server.reports.get(msg_id, {})
+                pulls = report.get("pulls", {})
+                if pulls.get(str(pull_json["number"])) == state:
+                    continue
+                pulls[str(pull_json["number"])] = state
+                report["pulls"] = pulls
+                server.reports[msg_id] = report
+                self.saveConfig()
+                await self.postToReportThread(msg_id, "**Issue #{0}**: pull request <{1}> is {2}".format(number, pull_json["html_url"], state))
+
+    async def markReportState(self, server, msg_id, report, status):
+        ch_id = report.get("channel", server.issue)
+        # channels of guilds on another worker's shards are not in the cache
+        channel = self.client.get_channel(ch_id)
+        if channel is None:
+            channel = await self.client.fetch_channel(ch_id)
+        report_msg = channel.get_partial_message(int(msg_id))
+        if status["state"] == "closed":
+            await report_msg.add_reaction(NOT_PLANNED_EMOJI if status["reason"] == "not_planned" else CLOSED_EMOJI)
+            await report_msg.remove_reaction(PUSHED_EMOJI, self.client.user)
+        else:
+            await report_msg.add_reaction(PUSHED_EMOJI)
+            await report_msg.remove_reaction(CLOSED_EMOJI, self.client.user)
+            await report_msg.remove_reaction(NOT_PLANNED_EMOJI, self.client.user)
+
+    async def postToReportThread(self, msg_id, text):
+        # the thread shares its id with the report; archived threads are not in the cache
+        thread = self.client.get_channel(int(msg_id))
+        if thread is None:
+            try:
+                thread = await self.client.fetch_channel(int(msg_id))
+            except discord.NotFound:
+                return
+        await thread.send(text)
+
+    def releaseIssue(self, args):
+        # the push failed for good; let staff push the report again
+        server = self.config.servers[str(args["guild"])]
+        issue = server.issues.get(str(args["message"]))
+        if issue is not None and issue["number"] is None:
+            server.issues.pop(str(args["message"]), None)
+            self.saveConfig()
+
+    async def runReact(self, args):
+        channel = self.client.get_channel(args["channel"])
+        await channel.get_partial_message(args["message"]).add_reaction(args["emoji"])
 
 
     async def linkEarliestUnresolved(self, msg):
 
         server = self.config.servers[str(msg.guild.id)]
         ch_id = server.issue
-        earliest_unresolved = server.after_post
-        channel = self.client.get_channel(ch_id)
+        if not server.unresolved_synced:
+            await self.rescanUnresolved(server)
+
+        earliest_unresolved = min(server.unresolved, default=server.after_post)
+        await msg.channel.send(msg.author.mention + "Earliest unresolved issue: https://discord.com/channels/{0}/{1}/{2}".format(msg.guild.id, ch_id, earliest_unresolved))
+
+        server.after_post = earliest_unresolved
+        self.saveConfig()
+
+    async def rescanUnresolved(self, server):
+        # full pass over the issue channel; the index is kept current by events in between
+        channel = self.client.get_channel(server.issue)
+        # the issue channel was deleted or the bot can no longer see it
+        if channel is None:
+            return
+        guild_id_str = str(channel.guild.id)
+        changes = {}
+        self.rescans[guild_id_str] = changes
+        unresolved = set()
         prevMsg = None
-        while True:
-            count = 0
-            async for message in channel.history(limit=100, before=prevMsg):
-                count += 1
-                prevMsg = message
-                if message.id < server.after_post:
-                    count = 0
+        try:
+            while True:
+                count = 0
+                async for message in channel.history(limit=100, before=prevMsg):
+                    count += 1
+                    prevMsg = message
+                    if message.id < server.after_post:
+                        count = 0
+                        break
+                    try:
+                        needs_attention = await self.checkNeedsAttention(message)
+                        if needs_attention:
+                            unresolved.add(message.id)
+                    except Exception as e:
+                        await self.sendError(traceback.format_exc())
+                if count == 0:
                     break
+        finally:
+            if self.rescans.get(guild_id_str) is changes:
+                del self.rescans[guild_id_str]
+
+        # reports added or resolved while the scan ran are newer than what it saw
+        for msg_id in changes:
+            if changes[msg_id]:
+                unresolved.add(msg_id)
+            else:
+                unresolved.discard(msg_id)
+        server.unresolved = unresolved
+        server.unresolved_synced = True
+        self.saveConfig()
+
+    async def reconcileUnresolved(self):
+        # the saved index may have missed anything that happened while the bot was down
+        while True:
+            for guild_id_str in list(self.config.servers):
                 try:
-                    needs_attention = await self.checkNeedsAttention(message)
-                    if needs_attention:
-                        earliest_unresolved = message.id
+                    await self.rescanUnresolved(self.config.servers[guild_id_str])
                 except Exception as e:
                     await self.sendError(traceback.format_exc())
-            if count == 0:
-                break
+            await asyncio.sleep(UNRESOLVED_RESCAN_INTERVAL)
 
-        await msg.channel.send(msg.author.mention + "Earliest unresolved issue: https://discord.com/channels/{0}/{1}/{2}".format(msg.guild.id, ch_id, earliest_unresolved))
+    async def syncIssueIndex(self):
+        # with several workers only the one with shard 0 polls GitHub and writes the index
+        if self.shard_ids is not None and 0 not in self.shard_ids:
+            while True:
+                await asyncio.sleep(ISSUE_SYNC_INTERVAL)
+                try:
+                    self.issue_index.reload()
+                except Exception as e:
+                    await self.sendError(traceback.format_exc())
 
-        server.after_post = earliest_unresolved
+        while True:
+            try:
+                changed = await self.issue_index.sync(self.github)
+            except Exception as e:
+                changed = []
+                await self.sendError(traceback.format_exc())
+            # the webhook usually got here first; this catches whatever it missed
+            for issue_json in changed:
+                try:
+                    if "pull_request" in issue_json:
+                        await self.applyPullRequest(issue_json)
+                    else:
+                        await self.applyIssueStatus(issue_json)
+                except Exception as e:
+                    await self.sendError(traceback.format_exc())
+            await asyncio.sleep(ISSUE_SYNC_INTERVAL)
+
+    def addReport(self, msg):
+        if msg.author.bot or msg.type == discord.MessageType.thread_created:
+            return
+        server = self.config.servers[str(msg.guild.id)]
+        server.unresolved.add(msg.id)
+        self.noteRescanChange(msg.guild.id, msg.id, True)
         self.saveConfig()
 
+    def resolveReport(self, guild_id, msg_id):
+        server = self.config.servers[str(guild_id)]
+        self.noteRescanChange(guild_id, msg_id, False)
+        if msg_id in server.unresolved:
+            server.unresolved.discard(msg_id)
+            self.saveConfig()
+
+    def noteRescanChange(self, guild_id, msg_id, needs_attention):
+        changes = self.rescans.get(str(guild_id))
+        if changes is not None:
+            changes[msg_id] = needs_attention
+
+    async def recheckReport(self, msg):
+        # a staff reaction was taken back; the report may need attention again
+        server = self.config.servers[str(msg.guild.id)]
+        if msg.id < server.after_post:
+            return
+        if await self.checkNeedsAttention(msg):
+            self.addReport(msg)
+
 
     async def checkNeedsAttention(self, msg):
         # check for messages in #bug-reports
@@ -207,192 +962,145 @@ class IssueBot:
         if msg.type == discord.MessageType.thread_created:
             return False
 
-        reacted = False
         for reaction in msg.reactions:
-            async for user in reaction.users():
-                if user.id == self.config.root:
-                    reacted = True
-                elif user.id == self.client.user.id:
-                    reacted = True
-                #else:
-                #    remove_users.append((reaction, user))
+            # the bot's own reaction is known without asking
+            if reaction.me:
+                return False
+            if await self.reactions.hasUser(reaction, self.config.root):
+                return False
+
+        # pushed reports are followed on GitHub, whatever their reactions
+        if str(msg.id) in self.config.servers[str(msg.guild.id)].issues:
+            return False
 
-        return not reacted
+        return True
 
 
     async def beginIssue(self, msg):
         # create the thread
         thread = await msg.create_thread(name=msg.content.split('\n')[0][:50])
         # Click :leftwards_arrow_with_hook: to undo the last answer.
+        # the intro, any likely duplicates and the first question go out as one message
         return_txt = "Thread created.  The bot will ask some questions.  Answering them will expedite the process."
+        related = self.issue_index.search(msg.content)
+        if len(related) > 0:
+            return_txt += "\n\nThese existing issues look similar:"
+            for score, number in related:
+                issue = self.issue_index.issues[number]
+                return_txt += "\n#{0} {1} <{2}>".format(number, issue["title"], issue["url"])
+        survey = self.getSurvey(str(msg.guild.id))
+        return_txt += "\n\n" + survey.getPrompt(msg.author.id, survey.start)
+        await self.postStep(thread, msg.author.id, survey.start, return_txt, survey.reactions[survey.start])
+
+    async def postStep(self, thread, issue_reporter, step, return_txt, reactions):
         survey_msg = await thread.send(return_txt)
-        return_txt = msg.author.mention + "\n1. Is this a :beetle: Bug, :bulb: Feature Request, or :abc: Text Mistake?"
-        survey_msg = await thread.send(return_txt)
-        await survey_msg.add_reaction('\U0001FAB2')
-        await survey_msg.add_reaction('\U0001F4A1')
-        await survey_msg.add_reaction('\U0001F524')
 
-        server = self.config.servers[str(msg.guild.id)]
-        server.threads.append(thread.id)
+        # remember where the survey is before the reactions go up, so an early click is already understood
+        state = SurveyState()
+        state.reporter = issue_reporter
+        state.step = step
+        state.prompt = survey_msg.id
+        server = self.config.servers[str(thread.guild.id)]
+        server.threads[str(thread.id)] = state
         self.saveConfig()
 
+        # the reactions don't depend on each other, so add them all at once
+        await asyncio.gather(*[survey_msg.add_reaction(emoji) for emoji in reactions])
+        return survey_msg
+
     async def getCurrentStep(self, thread):
         server = self.config.servers[str(thread.guild.id)]
-
-        if thread.id in server.threads:
-            # get the latest message written by the bot
-            async for message in thread.history(limit=None):
-                if message.author.id == self.client.user.id:
-                    message_lines = message.content.split('\n')
-                    mention = message.mentions[0].id
-                    prefix = message_lines[1].split('.')[0]
-                    return mention, prefix, message
-
-        return None, None, None
-
-
-    async def moveToNextStep(self, issue_reporter, prefix, msg):
-        thread = msg.channel
-        completed = False
-
-        if prefix == "1":
-            if await self.chose_emoji(issue_reporter, msg, '\U0001FAB2'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n2. Please attach the log file for this error.  Logs are found in the `LOG/` folder.  Attach the `.txt` file with the date that matches when you encountered the bug.\nIf this bug occurred outside of the game (such as with the updater), click :x:"
-                survey_msg = await thread.send(return_txt)
-                # await survey_msg.add_reaction('\U000021A9')
-                await survey_msg.add_reaction('\U0000274C')
-            elif await self.chose_emoji(issue_reporter, msg, '\U0001F4A1') or await self.chose_emoji(issue_reporter, msg, '\U0001F524'):
-                completed = True
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "2":
-            if self.has_attachment(issue_reporter, msg, '.txt'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n3. Was this bug was encountered in a dungeon adventure?"
-                survey_msg = await thread.send(return_txt)
-                # await survey_msg.add_reaction('\U000021A9')
-                await survey_msg.add_reaction('\U00002705')
-                await survey_msg.add_reaction('\U0000274C')
-            elif await self.chose_emoji(issue_reporter, msg, '\U0000274C'):
-                completed = True
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "3":
-            if await self.chose_emoji(issue_reporter, msg, '\U00002705'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n3a. Did you :checkered_flag: finish that adventure, or are you still :flag_white: in the middle of it?"
-                survey_msg = await thread.send(return_txt)
-                await survey_msg.add_reaction('\U0001F3C1')
-                await survey_msg.add_reaction('\U0001F3F3')
-            elif await self.chose_emoji(issue_reporter, msg, '\U0000274C'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n4. Was this bug encountered while :video_game: Playing or :pencil: Editing the game?"
-                survey_msg = await thread.send(return_txt)
-                # await survey_msg.add_reaction('\U000021A9')
-                await survey_msg.add_reaction('\U0001F3AE')
-                await survey_msg.add_reaction('\U0001F4DD')
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "3a":
-            if await self.chose_emoji(issue_reporter, msg, '\U0001F3C1'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n3b. Please attach a replay (`.rsrec`) of the adventure.\nCheck replays ingame at the Title Menu under Records, and find the files themselves in the `REPLAY/` folder.\nMake sure the error shows up in the replay."
-                survey_msg = await thread.send(return_txt)
-            elif await self.chose_emoji(issue_reporter, msg, '\U0001F3F3'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n3c. Please attach your quicksave file (`QUICKSAVE.rsqs`).  You can find it in the `SAVE/` folder."
-                survey_msg = await thread.send(return_txt)
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "3b":
-            if self.has_attachment(issue_reporter, msg, '.rsrec'):
-                completed = True
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "3c":
-            if self.has_attachment(issue_reporter, msg, '.rsqs'):
-                completed = True
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "4":
-            if await self.chose_emoji(issue_reporter, msg, '\U0001F4DD'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n4a. Starting from when you open the game, can you list the exact steps to reproduce this issue?  :x: if this was already mentioned."
-                survey_msg = await thread.send(return_txt)
-                # await survey_msg.add_reaction('\U000021A9')
-                await survey_msg.add_reaction('\U0000274C')
-            elif await self.chose_emoji(issue_reporter, msg, '\U0001F3AE'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n5. Please attach your save file.  You can find it in the `SAVE/` folder named `SAVE.rssv`"
-                survey_msg = await thread.send(return_txt)
-                # await survey_msg.add_reaction('\U000021A9')
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "4a":
-            if self.sent_any_text(issue_reporter, msg):
-                completed = True
-            elif await self.chose_emoji(issue_reporter, msg, '\U0000274C'):
-                completed = True
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "5":
-            if self.has_attachment(issue_reporter, msg, '.rssv'):
-                return_txt = "<@!{0}>".format(issue_reporter) + "\n5a. Starting from when you load your save file, can you list the exact steps to reproduce this issue?  :x: if this was already mentioned."
-                survey_msg = await thread.send(return_txt)
-                # await survey_msg.add_reaction('\U000021A9')
-                await survey_msg.add_reaction('\U0000274C')
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-        elif prefix == "5a":
-            if self.sent_any_text(issue_reporter, msg):
-                completed = True
-            elif await self.chose_emoji(issue_reporter, msg, '\U0000274C'):
-                completed = True
-            else:
-                await self.respondInvalid(issue_reporter, msg)
-
-        if completed:
-            return_txt = "Questionaire complete! You can continue to post information from here on if you have updates."
-            survey_msg = await thread.send(return_txt)
-            # await survey_msg.add_reaction('\U000021A9')
-            server = self.config.servers[str(msg.guild.id)]
-            server.threads.remove(thread.id)
+        thread_key = str(thread.id)
+
+        if thread_key not in server.threads:
+            return None, None, None
+
+        state = server.threads[thread_key]
+        if state is None:
+            # no record yet (e.g. a config from before states were kept); recover it once
+            state = await self.rebuildSurveyState(thread)
+            if state is None:
+                return None, None, None
+            server.threads[thread_key] = state
             self.saveConfig()
 
-    async def chose_emoji(self, issue_reporter, msg, emoji):
-
-        if msg.author.id != self.client.user.id:
+        return state.reporter, state.step, state.prompt
+
+    async def rebuildSurveyState(self, thread):
+        # get the latest message written by the bot
+        async for message in thread.history(limit=None):
+            # only survey prompts mention the reporter
+            if message.author.id == self.client.user.id and len(message.mentions) > 0:
+                step = getStepPrefix(message.content)
+                if step is None:
+                    continue
+                state = SurveyState()
+                state.reporter = message.mentions[0].id
+                state.step = step
+                state.prompt = message.id
+                return state
+        return None
+
+    def getSurvey(self, guild_id_str):
+        survey = self.surveys.get(guild_id_str)
+        if survey is None:
+            definition = self.config.servers[guild_id_str].survey
+            survey = Survey.CompiledSurvey(definition if len(definition) > 0 else Survey.DEFAULT_SURVEY)
+            self.surveys[guild_id_str] = survey
+        return survey
+
+    async def moveToNextStep(self, server, thread, issue_reporter, prefix, keys, msg):
+        survey = self.getSurvey(str(thread.guild.id))
+        result = Survey.advance(survey, prefix, keys)
+        if result is None:
             return False
 
-        # go through users of the specified emoji
-        for reaction in msg.reactions:
-            if reaction.emoji == emoji:
-                async for user in reaction.users():
-                    # if the issue reporter's response is found, return true
-                    if user.id == issue_reporter:
-                        return True
-
-        return False
-
-    def has_attachment(self, issue_reporter, msg, extension):
-
-        if msg.author.id != issue_reporter:
-            return False
-
-        if len(msg.attachments) == 0:
-            return False
-
-        file_name = msg.attachments[0].filename
-
-        # check the attachment.  if is has the extension, return true
-        _, ext = os.path.splitext(file_name)
-        if ext == extension:
-            return ext
+        target, action = result
+        # work on the attachment in the background; the survey does not wait on the download
+        if action == Survey.ACTION_LOG:
+            self.runInBackground(self.summarizeLog(thread, msg.attachments[0]))
+        elif action == Survey.ACTION_MIRROR:
+            self.runInBackground(self.mirrorSurveyFiles(thread, msg))
 
+        if target == Survey.DONE:
+            server.threads.pop(str(thread.id), None)
+            self.saveConfig()
+            await thread.send(survey.complete)
+        else:
+            await self.postStep(thread, issue_reporter, target, survey.getPrompt(issue_reporter, target), survey.reactions[target])
         return True
 
-    def sent_any_text(self, issue_reporter, msg):
-
-        if msg.author.id != issue_reporter:
-            return False
-
-        if msg.content == "":
-            return False
-
-        return True
+    def runInBackground(self, coro):
+        task = self.client.loop.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+        return task
+
+    async def summarizeLog(self, thread, attachment):
+        try:
+            summary = await self.log_analyzer.analyze(self.getDownloadSession(), attachment.url)
+            text = summary.getText()
+            server = self.config.servers[str(thread.guild.id)]
+            # the thread shares its id with the report it was opened from
+            report = server.reports.get(str(thread.id), {})
+            report["log"] = text
+            server.reports[str(thread.id)] = report
+            self.saveConfig()
+            await thread.send("**Log summary**\n```\n{0}\n```".format(text[:1900]))
+        except Exception as e:
+            await self.sendError(traceback.format_exc())
+
+    async def mirrorSurveyFiles(self, thread, msg):
+        try:
+            urls = await asyncio.gather(*[self.getAttachmentUrl(attachment) for attachment in msg.attachments])
+            files = [{ "name": attachment.filename, "url": url } for attachment, url in zip(msg.attachments, urls)]
+            server = self.config.servers[str(thread.guild.id)]
+            report = server.reports.get(str(thread.id), {})
+            report["files"] = report.get("files", []) + files
+            server.reports[str(thread.id)] = report
+            self.saveConfig()
+        except Exception as e:
+            await self.sendError(traceback.format_exc())
 
     async def initServer(self, msg, args):
 
@@ -421,54 +1129,170 @@ class IssueBot:
             await msg.channel.send(msg.author.mention + " Bad channel perms for chat!")
             return
 
-        new_server = BotServer()
-        new_server.prefix = prefix
-        new_server.issue = issue_ch.id
-        new_server.chat = bot_ch.id
-        self.config.servers[str(init_guild.id)] = new_server
+        server = self.config.servers.get(str(init_guild.id))
+        if server is None:
+            server = BotServer()
+            self.addServer(str(init_guild.id), server)
+            self.surveys.pop(str(init_guild.id), None)
+        elif server.issue != issue_ch.id:
+            # the unresolved index was built from the old issue channel
+            server.unresolved_synced = False
+        # re-initializing only moves the bot; pushed issues, threads and the survey are kept
+        server.prefix = prefix
+        server.issue = issue_ch.id
+        server.chat = bot_ch.id
+        self.buildRoutes()
 
         self.saveConfig()
         await msg.channel.send(msg.author.mention + " Initialized bot to this server!")
 
+    def addCommand(self, role, command):
+        self.commands[role][command.name] = command
+
+    def registerCommands(self):
+        # every command lives here once; dispatch and both help listings read from it
+        self.commands = { ROUTE_CHAT: {}, ROUTE_ISSUE: {} }
+        self.addCommand(ROUTE_CHAT, BotCommand("help", self.help, "Help", "[command]"))
+        self.addCommand(ROUTE_CHAT, BotCommand("staffhelp", self.staffhelp, "Approver Help", "[command]"))
+        self.addCommand(ROUTE_CHAT, BotCommand("unresolved", lambda msg, args: self.linkEarliestUnresolved(msg),
+                                               "Links the earliest report nobody has responded to"))
+        self.addCommand(ROUTE_CHAT, BotCommand("bulk", self.bulkPush, "Pushes several reports as issues at once",
+                                               "[label ...] <message link or id> ...", staff=True))
+        self.addCommand(ROUTE_CHAT, BotCommand("lookup", self.lookupIssue, "Shows the issue a report was pushed as",
+                                               "<message link or id>"))
+        self.addCommand(ROUTE_CHAT, BotCommand("stats", self.showStats, "Shows handler and API call timings", root=True))
+        self.addCommand(ROUTE_CHAT, BotCommand("profile", self.profileBot, "Samples where the bot spends its time and flags loop stalls",
+                                               "[seconds]", root=True))
+        self.addCommand(ROUTE_CHAT, BotCommand("update", lambda msg, args: self.updateBot(msg),
+                                               "Pulls the latest code and restarts the bot", root=True))
+        self.addCommand(ROUTE_ISSUE, BotCommand("issue", lambda msg, args: self.pushIssue(msg, " ".join(args), []),
+                                                "Reply to a report to push it as an issue", "<title>", staff=True))
+        self.addCommand(ROUTE_ISSUE, BotCommand("text", lambda msg, args: self.pushIssue(msg, " ".join(args), ["text"]),
+                                                "Reply to a report to push it as a text issue", "<title>", staff=True))
+        self.addCommand(ROUTE_ISSUE, BotCommand("bug", lambda msg, args: self.pushIssue(msg, " ".join(args), ["bug"]),
+                                                "Reply to a report to push it as a bug", "<title>", staff=True))
+        self.addCommand(ROUTE_ISSUE, BotCommand("enhancement", lambda msg, args: self.pushIssue(msg, " ".join(args), ["enhancement"]),
+                                                "Reply to a report to push it as an enhancement", "<title>", staff=True))
+
+    def findCommand(self, base_arg):
+        for role in self.commands:
+            if base_arg in self.commands[role]:
+                return self.commands[role][base_arg]
+        return None
+
+    async def canRun(self, command, msg):
+        if command.root:
+            return msg.author.id == self.config.root
+        if command.staff:
+            return await self.isAuthorized(msg.author, msg.guild)
+        return True
+
+    async def handleChat(self, server, msg):
+        if not msg.content.startswith(server.prefix):
+            return
+        args = msg.content[len(server.prefix):].split(' ')
+        command = self.commands[ROUTE_CHAT].get(args[0].lower())
+        if command is None or not await self.canRun(command, msg):
+            await msg.channel.send(msg.author.mention + " Unknown Command.")
+            return
+        await command.handler(msg, args[1:])
+
+    async def handleIssue(self, server, msg):
+        if not msg.content.startswith(server.prefix):
+            self.addReport(msg)
+            await self.beginIssue(msg)
+            return
+
+        if msg.reference is None:
+            return
+        args = msg.content[len(server.prefix):].split(' ')
+        command = self.commands[ROUTE_ISSUE].get(args[0].lower())
+        if command is None or not await self.canRun(command, msg):
+            await msg.add_reaction('\U0000274C')
+            return
+        await command.handler(msg, args[1:])
+
+    async def handleThread(self, server, msg):
+        # events for one thread run in order, so a step can't be answered twice
+        async with self.thread_locks.hold(msg.channel.id):
+            reporter, prefix, prompt_id = await self.getCurrentStep(msg.channel)
+            # other people are free to talk in the thread
+            if reporter is None or msg.author.id != reporter:
+                return
+            if not await self.moveToNextStep(server, msg.channel, reporter, prefix, Survey.message_keys(msg), msg):
+                await msg.add_reaction('\U0000274C')
+
+    async def handleThreadReaction(self, server, thread, payload):
+        async with self.thread_locks.hold(thread.id):
+            reporter, prefix, prompt_id = await self.getCurrentStep(thread)
+            # the payload alone says who picked what; no need to look at the message
+            if reporter and prompt_id == payload.message_id and payload.user_id == reporter:
+                if await self.moveToNextStep(server, thread, reporter, prefix, [str(payload.emoji)], None):
+                    return
+            await thread.get_partial_message(payload.message_id).remove_reaction(payload.emoji, payload.member)
+
+    def listCommands(self, prefix, staff):
+        return_msg = ""
+        for role in self.commands:
+            for name in self.commands[role]:
+                command = self.commands[role][name]
+                if command.staff or command.root:
+                    if staff:
+                        return_msg += f"`{prefix}{name}` - {command.desc}\n"
+                elif not staff:
+                    return_msg += f"`{prefix}{name}` - {command.desc}\n"
+        return return_msg
+
+    def commandHelp(self, prefix, base_arg):
+        command = self.findCommand(base_arg)
+        if command is None:
+            return "Unknown Command."
+        return "**Command Help**\n" \
+            f"`{prefix}{command.name} {command.usage}`\n{command.desc}"
+
     async def help(self, msg, args):
         prefix = self.config.servers[str(msg.guild.id)].prefix
         if len(args) == 0:
-            return_msg = "**Commands**\n" \
-                  f"`{prefix}help` - Help\n"
+            return_msg = "**Commands**\n" + self.listCommands(prefix, False)
         else:
-            base_arg = args[0]
-            if base_arg == "help":
-                return_msg = "**Command Help**\n"
-            else:
-                return_msg = "Unknown Command."
+            return_msg = self.commandHelp(prefix, args[0].lower())
         await msg.channel.send(msg.author.mention + " {0}".format(return_msg))
 
 
     async def staffhelp(self, msg, args):
         prefix = self.config.servers[str(msg.guild.id)].prefix
         if len(args) == 0:
-            return_msg = "**Approver Commands**\n" \
-                  f"`{prefix}help` - Help\n"
+            return_msg = "**Approver Commands**\n" + self.listCommands(prefix, True)
         else:
-            base_arg = args[0]
-            if base_arg == "help":
-                return_msg = "**Command Help**\n"
-            else:
-                return_msg = "Unknown Command."
+            return_msg = self.commandHelp(prefix, args[0].lower())
         await msg.channel.send(msg.author.mention + " {0}".format(return_msg))
 
 
+def instrumented(handler):
+    # time every gateway event handler under its own name
+    name = handler.__name__
+    async def timed_handler(*args):
+        if issue_bot.recorder is not None:
+            issue_bot.recorder.record(name, args)
+        with issue_bot.stats.timed(name):
+            await handler(*args)
+    timed_handler.__name__ = name
+    return timed_handler
+
 @client.event
+@instrumented
 async def on_ready():
     print('Logged in as')
     print(client.user.name)
     print(client.user.id)
     global issue_bot
+    issue_bot.startBackgroundTasks()
     await issue_bot.checkRestarted()
     print('------')
 
 
 @client.event
+@instrumented
 async def on_message(msg: discord.Message):
     await client.wait_until_ready()
     try:
@@ -485,112 +1309,123 @@ async def on_message(msg: discord.Message):
             await issue_bot.initServer(msg, args[1:])
             return
 
-        # only respond to the proper guilds
-        guild_id_str = str(msg.guild.id)
-        if guild_id_str not in issue_bot.config.servers:
+        # one lookup decides which handler (if any) sees the message
+        route = issue_bot.getRoute(msg.channel.id)
+        if route is None:
             return
+        guild_id_str, role = route
+        await issue_bot.handlers[role](issue_bot.config.servers[guild_id_str], msg)
 
-        server = issue_bot.config.servers[guild_id_str]
-        prefix = server.prefix
-
+    except Exception as e:
+        await issue_bot.sendError(traceback.format_exc())
 
-        if msg.channel.id == server.chat:
-            if not content.startswith(prefix):
-                return
-            args = content[len(prefix):].split(' ')
-            base_arg = args[0].lower()
-
-            authorized = await issue_bot.isAuthorized(msg.author, msg.guild)
-            if base_arg == "help":
-                await issue_bot.help(msg, args[1:])
-            elif base_arg == "staffhelp":
-                await issue_bot.staffhelp(msg, args[1:])
-                # primary commands
-            elif base_arg == "unresolved":
-                await issue_bot.linkEarliestUnresolved(msg)
-            elif base_arg == "update" and msg.author.id == issue_bot.config.root:
-                await issue_bot.updateBot(msg)
-            else:
-                await msg.channel.send(msg.author.mention + " Unknown Command.")
-        elif msg.channel.id == server.issue:
-            if content.startswith(prefix):
-                args = content[len(prefix):].split(' ')
-                base_arg = args[0].lower()
-
-                if msg.reference is not None:
-                    authorized = await issue_bot.isAuthorized(msg.author, msg.guild)
-                    if base_arg == "issue" and authorized:
-                        await issue_bot.pushIssue(msg, [])
-                    elif base_arg == "text" and authorized:
-                        await issue_bot.pushIssue(msg, ["text"])
-                    elif base_arg == "bug" and authorized:
-                        await issue_bot.pushIssue(msg, ["bug"])
-                    elif base_arg == "enhancement" and authorized:
-                        await issue_bot.pushIssue(msg, ["enhancement"])
-                    else:
-                        await msg.add_reaction('\U0000274C')
-            else:
-                await issue_bot.beginIssue(msg)
-        elif msg.channel.type == discord.ChannelType.public_thread:
-            if msg.channel.parent.id == server.issue:
-                reporter, prefix, current_msg = await issue_bot.getCurrentStep(msg.channel)
-                if reporter:
-                    await issue_bot.moveToNextStep(reporter, prefix, msg)
+@client.event
+@instrumented
+async def on_raw_reaction_add(payload):
+    await client.wait_until_ready()
 
+    try:
+        issue_bot.reactions.add(payload.message_id, payload.emoji, payload.user_id)
 
+        if payload.user_id == client.user.id:
+            return
+        # reject reactions from the payload alone before touching the API
+        route = issue_bot.getRoute(payload.channel_id)
+        if route is None:
+            return
+        guild_id_str, role = route
+        channel = client.get_channel(payload.channel_id)
+        if role == ROUTE_ISSUE:
+            # do not allow reacting if not authorized
+            authorized = await issue_bot.isAuthorized(payload.member, channel.guild)
+            if not authorized:
+                await channel.get_partial_message(payload.message_id).remove_reaction(payload.emoji, payload.member)
+            else:
+                issue_bot.resolveReport(payload.guild_id, payload.message_id)
+        elif role == ROUTE_THREAD:
+            await issue_bot.handleThreadReaction(issue_bot.config.servers[guild_id_str], channel, payload)
 
     except Exception as e:
         await issue_bot.sendError(traceback.format_exc())
 
 @client.event
-async def on_raw_reaction_add(payload):
+@instrumented
+async def on_raw_reaction_remove(payload):
     await client.wait_until_ready()
 
     try:
+        issue_bot.reactions.remove(payload.message_id, payload.emoji, payload.user_id)
 
-        if payload.user_id == client.user.id:
+        route = issue_bot.getRoute(payload.channel_id)
+        if route is None or route[1] != ROUTE_ISSUE:
+            return
+        # only the root's or the bot's reactions count as a response
+        if payload.user_id != issue_bot.config.root and payload.user_id != client.user.id:
             return
-        guild_id_str = str(payload.guild_id)
         msg = await client.get_channel(payload.channel_id).fetch_message(payload.message_id)
-        server = issue_bot.config.servers[guild_id_str]
-        if payload.channel_id == server.issue:
-            # do not allow reacting if not authorized
-            authorized = await issue_bot.isAuthorized(payload.member, msg.guild)
-            if not authorized:
-                await msg.remove_reaction(payload.emoji, payload.member)
-        elif msg.channel.type == discord.ChannelType.public_thread:
-            if msg.channel.parent.id == server.issue:
-                reporter, prefix, current_msg = await issue_bot.getCurrentStep(msg.channel)
-                if reporter:
-                    if current_msg.id == msg.id:
-                        await issue_bot.moveToNextStep(reporter, prefix, msg)
-                    else:
-                        await msg.remove_reaction(payload.emoji, payload.member)
-                else:
-                    await msg.remove_reaction(payload.emoji, payload.member)
+        await issue_bot.recheckReport(msg)
+
+    except Exception as e:
+        await issue_bot.sendError(traceback.format_exc())
 
+@client.event
+@instrumented
+async def on_raw_reaction_clear(payload):
+    issue_bot.reactions.clear(payload.message_id)
+
+@client.event
+@instrumented
+async def on_raw_reaction_clear_emoji(payload):
+    issue_bot.reactions.clear(payload.message_id, payload.emoji)
+
+@client.event
+@instrumented
+async def on_raw_message_delete(payload):
+    await client.wait_until_ready()
 
+    try:
+        route = issue_bot.getRoute(payload.channel_id)
+        if route is not None and route[1] == ROUTE_ISSUE:
+            issue_bot.resolveReport(payload.guild_id, payload.message_id)
 
     except Exception as e:
         await issue_bot.sendError(traceback.format_exc())
 
-issue_bot = IssueBot(scdir, client)
+# imported by the benchmark harness without starting the bot
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discord bot for pushing reports to GitHub issues")
+    parser.add_argument("--shard-count", type=int, default=0, help="shards across all processes; 0 runs unsharded")
+    parser.add_argument("--shards", help="shard ids this process runs, e.g. 0-3; all of them if omitted")
+    options = parser.parse_args()
+    shard_ids = None
+    if options.shards is not None:
+        if options.shard_count <= 0:
+            parser.error("--shards needs --shard-count")
+        shard_ids = parseShardRange(options.shards)
+
+    if options.shard_count > 0:
+        client = discord.AutoShardedClient(intents=intent, shard_count=options.shard_count, shard_ids=shard_ids)
+        for name in GATEWAY_EVENTS:
+            client.event(globals()[name])
+
+    issue_bot = IssueBot(scdir, client, options.shard_count, shard_ids)
 
-with open(os.path.join(scdir, TOKEN_FILE_PATH)) as token_file:
-    token = token_file.read()
+    with open(os.path.join(scdir, TOKEN_FILE_PATH)) as token_file:
+        token = token_file.read()
 
-try:
-    client.run(token)
-except Exception as e:
-    trace = traceback.format_exc()
-    print(trace)
+    try:
+        client.run(token)
+    except Exception as e:
+        trace = traceback.format_exc()
+        print(trace)
 
+    issue_bot.flushConfig()
 
-if issue_bot.need_restart:
-    # restart
-    args = sys.argv[:]
-    args.insert(0, sys.executable)
-    if sys.platform == 'win32':
-        args = ['"%s"' % arg for arg in args]
+    if issue_bot.need_restart:
+        # restart
+        args = sys.argv[:]
+        args.insert(0, sys.executable)
+        if sys.platform == 'win32':
+            args = ['"%s"' % arg for arg in args]
 
-    os.execv(sys.executable, args)
+        os.execv(sys.executable, args)
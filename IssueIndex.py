@@ -0,0 +1,175 @@
+import os
+import re
+import math
+import json
+import BotStore
+
+
+MIN_TOKEN_LENGTH = 3
+# tokens in more than this fraction of issues say nothing about similarity
+MAX_DOC_FRACTION = 0.5
+STOP_WORDS = { "the", "and", "for", "with", "that", "this", "was", "are", "but", "not", "you", "when",
+               "have", "has", "from", "its", "can", "will", "there", "then", "into", "out", "get", "got" }
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+# crude stemming so "crash", "crashes" and "crashed" meet
+SUFFIXES = ("ing", "es", "ed", "s")
+
+
+def stem(token):
+    for suffix in SUFFIXES:
+        if len(token) > len(suffix) + 3 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    tokens = set()
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) >= MIN_TOKEN_LENGTH and token not in STOP_WORDS:
+            tokens.add(stem(token))
+    return tokens
+
+
+class IssueIndex:
+    """
+    Local inverted index over the repo's issue titles and bodies, used to suggest likely duplicates.
+    Synced incrementally from GitHub using updated-since and ETags.
+    """
+    def __init__(self, path):
+        self.path = path
+        # issue number -> { title, url, state, tokens }
+        self.issues = {}
+        # token -> set of issue numbers
+        self.postings = {}
+        # issue number -> idf-weighted vector length; rebuilt on the first search after the index changes
+        self.norms = None
+        # sync cursor: updated_at of the newest issue seen, and the ETag of that request
+        self.since = None
+        self.etag = None
+        # modification time of the file as last loaded
+        self.mtime = None
+        self.store = BotStore.JsonStore(path, self.getDict)
+
+    def load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path) as f:
+                main_dict = json.load(f)
+        except FileNotFoundError:
+            return
+        self.mtime = mtime
+        self.issues = {}
+        self.postings = {}
+        self.norms = None
+        self.since = main_dict["since"]
+        self.etag = main_dict["etag"]
+        for number in main_dict["issues"]:
+            issue = main_dict["issues"][number]
+            self.addIssue(int(number), issue["title"], issue["url"], issue["state"], set(issue["tokens"]))
+
+    def reload(self):
+        """
+        Loads the file again if another process has written it since; returns whether it did.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.load()
+        return True
+
+    def getDict(self):
+        issues = { }
+        for number in self.issues:
+            issue = dict(self.issues[number])
+            issue["tokens"] = sorted(issue["tokens"])
+            issues[str(number)] = issue
+        return { "since": self.since, "etag": self.etag, "issues": issues }
+
+    def addIssue(self, number, title, url, state, tokens):
+        self.removeIssue(number)
+        self.issues[number] = { "title": title, "url": url, "state": state, "tokens": tokens }
+        self.norms = None
+        for token in tokens:
+            self.postings.setdefault(token, set()).add(number)
+
+    def removeIssue(self, number):
+        issue = self.issues.pop(number, None)
+        if issue is None:
+            return
+        self.norms = None
+        for token in issue["tokens"]:
+            numbers = self.postings[token]
+            numbers.discard(number)
+            if len(numbers) == 0:
+                del self.postings[token]
+
+    def update(self, issue_json):
+        # the issues endpoint also lists pull requests
+        if "pull_request" in issue_json:
+            return
+        text = issue_json["title"] + "\n" + (issue_json["body"] or "")
+        self.addIssue(issue_json["number"], issue_json["title"], issue_json["html_url"], issue_json["state"], tokenize(text))
+        if self.since is None or issue_json["updated_at"] > self.since:
+            self.since = issue_json["updated_at"]
+
+    async def sync(self, github):
+        """
+        Pulls in everything updated since the last sync and returns it, pull requests included.
+        """
+        issues, etag = await github.list_issues(self.since, self.etag)
+        # nothing changed since the last poll
+        if issues is None:
+            return []
+        self.etag = etag
+        for issue_json in issues:
+            self.update(issue_json)
+        self.store.markDirty()
+        return issues
+
+    def idf(self, token):
+        return math.log(len(self.issues) / len(self.postings[token]))
+
+    def getNorms(self):
+        if self.norms is None:
+            # every idf moves when an issue comes or goes, so all the norms are redone together
+            idfs = { token: self.idf(token) for token in self.postings }
+            self.norms = {}
+            for number in self.issues:
+                self.norms[number] = math.sqrt(sum(idfs[token] ** 2 for token in self.issues[number]["tokens"]))
+        return self.norms
+
+    def search(self, text, limit=3, min_score=0.2):
+        """
+        Returns up to limit (score, number) pairs whose idf-weighted cosine similarity to text is at least min_score.
+        """
+        max_docs = max(len(self.issues) * MAX_DOC_FRACTION, 1)
+        weights = {}
+        for token in tokenize(text):
+            if token in self.postings and len(self.postings[token]) <= max_docs:
+                weights[token] = self.idf(token)
+        if len(weights) == 0:
+            return []
+
+        shared = {}
+        for token in weights:
+            for number in self.postings[token]:
+                shared[number] = shared.get(number, 0) + weights[token] ** 2
+
+        query_norm = math.sqrt(sum(weight ** 2 for weight in weights.values()))
+        # a token in every issue has no weight, so a tiny index can leave nothing to compare
+        if query_norm == 0:
+            return []
+        norms = self.getNorms()
+        results = []
+        for number in shared:
+            if norms[number] == 0:
+                continue
+            score = shared[number] / (query_norm * norms[number])
+            if score >= min_score:
+                results.append((score, number))
+        results.sort(reverse=True)
+        return results[:limit]
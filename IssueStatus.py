@@ -0,0 +1,79 @@
+import re
+import hmac
+import json
+import asyncio
+import hashlib
+import traceback
+from aiohttp import web
+
+
+WEBHOOK_PATH = '/github'
+# keywords GitHub itself treats as closing the issue a pull request mentions
+CLOSING_PATTERN = re.compile(r'\b(?:close[sd]?|fix(?:e[sd])?|resolve[sd]?)\s*:?\s+([\w.-]+/[\w.-]+)?#(\d+)', re.IGNORECASE)
+
+
+def verify_signature(secret, body, header):
+    """
+    Checks an X-Hub-Signature-256 header against the HMAC of the raw request body.
+    """
+    if header is None or not header.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header[len("sha256="):])
+
+
+def closing_refs(text, repo_full_name):
+    numbers = set()
+    for repo, number in CLOSING_PATTERN.findall(text or ""):
+        if repo == "" or repo.lower() == repo_full_name.lower():
+            numbers.add(int(number))
+    return numbers
+
+
+def issue_status(issue_json):
+    return { "state": issue_json["state"],
+             "reason": issue_json.get("state_reason"),
+             "labels": sorted(label["name"] for label in issue_json.get("labels", [])) }
+
+
+def pull_state(pull_json):
+    # the issues endpoint nests merged_at; pull request webhooks have it at the top
+    merged_at = pull_json.get("merged_at") or pull_json.get("pull_request", {}).get("merged_at")
+    if merged_at is not None:
+        return "merged"
+    return pull_json["state"]
+
+
+class WebhookReceiver:
+    """
+    Accepts GitHub webhook deliveries, drops any whose signature does not match the shared secret,
+    and hands (event name, payload) to handle in the background so GitHub gets its answer right away.
+    """
+    def __init__(self, secret, handle, report_error):
+        self.secret = secret
+        self.handle = handle
+        self.report_error = report_error
+
+    async def receive(self, request):
+        body = await request.read()
+        if not verify_signature(self.secret, body, request.headers.get("X-Hub-Signature-256")):
+            return web.Response(status=401)
+        event = request.headers.get("X-GitHub-Event", "")
+        if event == "ping":
+            return web.Response(status=200)
+        asyncio.get_running_loop().create_task(self.dispatch(event, json.loads(body)))
+        return web.Response(status=202)
+
+    async def dispatch(self, event, payload):
+        try:
+            await self.handle(event, payload)
+        except Exception:
+            await self.report_error(traceback.format_exc())
+
+    async def serve(self, host, port):
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.receive)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
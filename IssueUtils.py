@@ -1,8 +1,27 @@
 import json
 import requests
+import aiohttp
 import jwt
 import time
+import asyncio
+import contextlib
+import JobQueue
+from datetime import datetime, timezone
+from cryptography.hazmat.primitives import serialization
 
+# the app JWT lasts 10 minutes; stop handing it out a minute before that
+JWT_LIFETIME = 10 * 60
+JWT_MARGIN = 60
+# installation tokens last an hour; refresh them this long before they expire
+TOKEN_REFRESH_MARGIN = 5 * 60
+TOKEN_RETRY_DELAY = 30
+
+API_URL = 'https://api.github.com'
+# connection pool shared by every async GitHub call
+POOL_SIZE = 10
+KEEPALIVE_TIMEOUT = 60
+REQUEST_TIMEOUT = 30
+CONNECT_TIMEOUT = 10
 
 
 # https://gist.github.com/pelson/47c0c89a3522ed8da5cc305afc2562b0
@@ -34,10 +53,223 @@ def get_access_token_header(private_key, app_id, install_id):
 
     resp_json = json.loads(resp.content.decode())
 
-    headers = {"Authorization": "token {}".format(resp_json["token"]),
+    return token_header(resp_json["token"])
+
+def token_header(token):
+    headers = {"Authorization": "token {}".format(token),
                "Accept": "application/vnd.github.machine-man-preview+json"}
     return headers
 
+def parse_github_time(time_str):
+    return datetime.strptime(time_str, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+
+
+class AppCredentials:
+    """
+    Keeps the app JWT and installation token cached until just before they expire.
+    """
+    def __init__(self, private_key, app_id, install_id):
+        # parse the PEM once instead of on every signature
+        self.key = serialization.load_pem_private_key(private_key.encode(), password=None)
+        self.app_id = app_id
+        self.install_id = install_id
+        self.jwt_header = None
+        self.jwt_expires = 0
+        self.token = None
+        self.token_expires = 0
+
+    def get_bearer_header(self):
+        now = time.time()
+        if self.jwt_header is None or now >= self.jwt_expires - JWT_MARGIN:
+            self.jwt_header = create_bearer_token_header(self.key, self.app_id)
+            self.jwt_expires = now + JWT_LIFETIME
+        return self.jwt_header
+
+    def token_valid(self, margin):
+        return self.token is not None and time.time() < self.token_expires - margin
+
+    def set_token(self, resp_json):
+        self.token = resp_json["token"]
+        self.token_expires = parse_github_time(resp_json["expires_at"])
+
+
+class GithubClient:
+    """
+    Non-blocking GitHub client that keeps one pooled keep-alive session open.
+    """
+    def __init__(self, credentials, repo_owner, repo_name, api_url=API_URL):
+        self.credentials = credentials
+        self.repo_owner = repo_owner
+        self.repo_name = repo_name
+        self.api_url = api_url
+        self.session = None
+        self.token_lock = None
+        # node ids needed by GraphQL mutations, fetched once
+        self.repo_id = None
+        self.label_ids = {}
+        # last rate-limit headers seen from the API
+        self.rate_remaining = None
+        self.rate_reset = 0
+        # optional BotStats to record call latency into
+        self.stats = None
+
+    def get_session(self):
+        # the session must be created inside the running event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=KEEPALIVE_TIMEOUT)
+            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, sock_connect=CONNECT_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def timed(self, name):
+        if self.stats is None:
+            return contextlib.nullcontext()
+        return self.stats.timed("github " + name)
+
+    def check_rate_limit(self):
+        if self.rate_remaining == 0 and time.time() < self.rate_reset:
+            raise JobQueue.RetryLater(self.rate_reset - time.time())
+
+    def read_rate_limit(self, resp):
+        if "X-RateLimit-Remaining" in resp.headers:
+            self.rate_remaining = int(resp.headers["X-RateLimit-Remaining"])
+            self.rate_reset = int(resp.headers.get("X-RateLimit-Reset", 0))
+            if self.stats is not None:
+                self.stats.setGauge("github_rate_remaining", self.rate_remaining)
+
+        if resp.status in (403, 429):
+            # secondary rate limits send Retry-After; primary ones run the remaining count to 0
+            if "Retry-After" in resp.headers:
+                raise JobQueue.RetryLater(int(resp.headers["Retry-After"]))
+            if self.rate_remaining == 0:
+                raise JobQueue.RetryLater(max(self.rate_reset - time.time(), 1))
+
+    async def request(self, method, url, headers, json_data=None, name=None):
+        self.check_rate_limit()
+        with self.timed(name or method):
+            async with self.get_session().request(method, url, headers=headers, json=json_data) as resp:
+                self.read_rate_limit(resp)
+                resp.raise_for_status()
+                return await resp.json()
+
+    async def refresh_token(self):
+        if self.token_lock is None:
+            self.token_lock = asyncio.Lock()
+        async with self.token_lock:
+            # another caller may have refreshed it while we waited
+            if self.credentials.token_valid(TOKEN_REFRESH_MARGIN):
+                return
+            url = '{0}/app/installations/{1}/access_tokens'.format(self.api_url, self.credentials.install_id)
+            resp_json = await self.request('POST', url, self.credentials.get_bearer_header(), name='access_token')
+            self.credentials.set_token(resp_json)
+
+    async def get_header(self):
+        if not self.credentials.token_valid(JWT_MARGIN):
+            await self.refresh_token()
+        return token_header(self.credentials.token)
+
+    async def keep_fresh(self):
+        # mint the next installation token ahead of time so pushes never wait on it
+        while True:
+            try:
+                if not self.credentials.token_valid(TOKEN_REFRESH_MARGIN):
+                    await self.refresh_token()
+                delay = self.credentials.token_expires - TOKEN_REFRESH_MARGIN - time.time()
+            except Exception:
+                delay = TOKEN_RETRY_DELAY
+            await asyncio.sleep(max(delay, TOKEN_RETRY_DELAY))
+
+    async def create_issue(self, title, body, labels):
+        url = '{0}/repos/{1}/{2}/issues'.format(self.api_url, self.repo_owner, self.repo_name)
+        issue = {'title': title,
+                 'body': body,
+                 'labels': labels}
+        return await self.request('POST', url, await self.get_header(), issue, name='create_issue')
+
+    async def list_issues(self, since, etag):
+        """
+        Lists issues updated at or after since.  Returns (None, etag) if nothing changed,
+        which GitHub answers with a 304 that does not count against the rate limit.
+        """
+        url = '{0}/repos/{1}/{2}/issues'.format(self.api_url, self.repo_owner, self.repo_name)
+        params = { 'state': 'all', 'sort': 'updated', 'direction': 'asc', 'per_page': 100 }
+        if since is not None:
+            params['since'] = since
+        headers = dict(await self.get_header())
+        if etag is not None:
+            headers['If-None-Match'] = etag
+
+        issues = []
+        new_etag = etag
+        first_page = True
+        while url is not None:
+            self.check_rate_limit()
+            with self.timed('list_issues'):
+                async with self.get_session().get(url, headers=headers, params=params) as resp:
+                    self.read_rate_limit(resp)
+                    if resp.status == 304:
+                        return None, etag
+                    resp.raise_for_status()
+                    if first_page:
+                        new_etag = resp.headers.get('ETag')
+                        first_page = False
+                    issues.extend(await resp.json())
+                    next_link = resp.links.get('next')
+                    url = str(next_link['url']) if next_link is not None else None
+            # the next link already carries the query string
+            params = None
+            headers.pop('If-None-Match', None)
+        return issues, new_etag
+
+    async def graphql(self, query, variables):
+        resp_json = await self.request('POST', '{0}/graphql'.format(self.api_url), await self.get_header(),
+                                       { 'query': query, 'variables': variables }, name='graphql')
+        if resp_json.get('data') is None:
+            raise Exception("GraphQL error: {0}".format(resp_json.get('errors')))
+        return resp_json
+
+    async def get_repository_ids(self):
+        if self.repo_id is not None:
+            return
+        query = 'query($owner: String!, $name: String!) { repository(owner: $owner, name: $name) { ' \
+                'id labels(first: 100) { nodes { id name } } } }'
+        resp_json = await self.graphql(query, { 'owner': self.repo_owner, 'name': self.repo_name })
+        repository = resp_json['data']['repository']
+        self.label_ids = { label['name']: label['id'] for label in repository['labels']['nodes'] }
+        self.repo_id = repository['id']
+
+    async def missing_labels(self, labels):
+        # GraphQL takes label ids, so labels the repo doesn't have would be dropped silently
+        await self.get_repository_ids()
+        return [label for label in labels if label not in self.label_ids]
+
+    async def create_issues(self, issues):
+        """
+        Creates every (title, body, labels) in one aliased GraphQL mutation.
+        Returns a { number, url } dict per issue, or None where that issue failed.
+        """
+        await self.get_repository_ids()
+        declares = []
+        fields = []
+        variables = {}
+        for idx, (title, body, labels) in enumerate(issues):
+            declares.append('$in{0}: CreateIssueInput!'.format(idx))
+            fields.append('i{0}: createIssue(input: $in{0}) {{ issue {{ number url }} }}'.format(idx))
+            variables['in{0}'.format(idx)] = { 'repositoryId': self.repo_id, 'title': title, 'body': body,
+                                               'labelIds': [self.label_ids[label] for label in labels if label in self.label_ids] }
+        query = 'mutation({0}) {{ {1} }}'.format(', '.join(declares), ' '.join(fields))
+        resp_json = await self.graphql(query, variables)
+
+        results = []
+        for idx in range(len(issues)):
+            created = resp_json['data'].get('i{0}'.format(idx))
+            results.append(created['issue'] if created is not None else None)
+        return results
+
 def create_issue(headers, repo_owner, repo_name, title, body, labels):
     url = 'https://api.github.com/repos/%s/%s/issues' % (repo_owner, repo_name)
     issue = {'title': title,
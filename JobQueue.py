@@ -0,0 +1,93 @@
+import time
+import uuid
+import random
+import asyncio
+import traceback
+
+
+JOB_WORKERS = 2
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 10 * 60
+
+
+class RetryLater(Exception):
+    """
+    Raised by a job runner when the remote side asked us to wait (rate limits, Retry-After).
+    """
+    def __init__(self, delay):
+        super().__init__("retry in {0:.0f}s".format(delay))
+        self.delay = delay
+
+
+class JobQueue:
+    """
+    Durable queue for outbound calls.  Pending jobs live in a persisted list until they succeed,
+    so they survive a restart; a small worker pool runs them with backoff between attempts.
+    """
+    def __init__(self, jobs, save, report_error, workers=JOB_WORKERS):
+        # the list is owned by the config so pending jobs are saved with it
+        self.jobs = jobs
+        self.save = save
+        self.report_error = report_error
+        self.workers = workers
+        self.runners = {}
+        self.give_ups = {}
+        self.queue = None
+
+    def register(self, kind, runner, give_up=None):
+        self.runners[kind] = runner
+        if give_up is not None:
+            self.give_ups[kind] = give_up
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        # anything left over from before a restart goes first
+        for job in self.jobs:
+            self.queue.put_nowait(job)
+        for _ in range(self.workers):
+            asyncio.get_running_loop().create_task(self.work())
+
+    def enqueue(self, kind, args):
+        job = { "id": uuid.uuid4().hex, "kind": kind, "args": args, "attempts": 0, "not_before": 0 }
+        self.jobs.append(job)
+        self.save()
+        if self.queue is not None:
+            self.queue.put_nowait(job)
+        return job
+
+    def finish(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+            self.save()
+
+    def retry(self, job, delay):
+        job["not_before"] = time.time() + delay
+        self.save()
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, job)
+
+    async def work(self):
+        while True:
+            job = await self.queue.get()
+            delay = job["not_before"] - time.time()
+            if delay > 0:
+                # restored from disk with a wait still pending
+                self.retry(job, delay)
+                continue
+            try:
+                await self.runners[job["kind"]](job["args"])
+                self.finish(job)
+            except RetryLater as e:
+                # waiting out a rate limit does not count as a failed attempt
+                self.retry(job, e.delay)
+            except Exception as e:
+                job["attempts"] += 1
+                trace = traceback.format_exc()
+                if job["attempts"] >= MAX_ATTEMPTS:
+                    self.finish(job)
+                    if job["kind"] in self.give_ups:
+                        self.give_ups[job["kind"]](job["args"])
+                    await self.report_error("Gave up on {0} job {1}:\n{2}".format(job["kind"], job["args"], trace))
+                else:
+                    backoff = min(BACKOFF_BASE ** job["attempts"], BACKOFF_MAX)
+                    self.retry(job, backoff * random.uniform(0.5, 1.0) + 1)
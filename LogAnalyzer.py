@@ -0,0 +1,110 @@
+import re
+import codecs
+import asyncio
+from collections import OrderedDict
+
+
+LOG_BYTE_CAP = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# a line longer than this is cut so a log without newlines can't grow the buffer
+MAX_LINE_LENGTH = 4096
+MAX_CONCURRENT = 3
+MAX_TRACES = 5
+MAX_FRAMES = 6
+
+# the game's log opens with its name and version, e.g. "RogueEssence 0.7.0"
+VERSION_PATTERN = re.compile(r"(?:version|RogueEssence)\W*v?(\d+(?:\.\d+)+)", re.IGNORECASE)
+# logged exceptions may carry a "[12:00:01]" timestamp in front
+EXCEPTION_PATTERN = re.compile(r"^\s*(?:\[[^\]]*\]\s*)?([\w.`]+(?:Exception|Error))\b")
+FRAME_PATTERN = re.compile(r"^\s+at\s")
+
+
+class LogSummary:
+    """
+    Version header and deduplicated stack traces pulled out of a game log, one line at a time.
+    """
+    def __init__(self):
+        self.version = None
+        # fingerprint -> [trace lines, occurrences]
+        self.traces = OrderedDict()
+        self.current = None
+        self.bytes_read = 0
+        self.truncated = False
+
+    def feedLine(self, line):
+        if self.version is None:
+            match = VERSION_PATTERN.search(line)
+            if match:
+                self.version = match.group(1)
+
+        if self.current is not None and FRAME_PATTERN.match(line):
+            self.current.append(line.strip())
+            return
+        self.endTrace()
+        if EXCEPTION_PATTERN.match(line):
+            self.current = [line.strip()]
+
+    def endTrace(self):
+        if self.current is None:
+            return
+        # the message can hold values that differ per occurrence, so key on type and frames only
+        fingerprint = (EXCEPTION_PATTERN.match(self.current[0]).group(1),) + tuple(self.current[1:])
+        if fingerprint in self.traces:
+            self.traces[fingerprint][1] += 1
+        else:
+            self.traces[fingerprint] = [self.current, 1]
+        self.current = None
+
+    def getText(self):
+        text = "Version: {0}\n".format(self.version or "unknown")
+        text += "{0} distinct exception(s)".format(len(self.traces))
+        if self.truncated:
+            text += " in the first {0} bytes".format(self.bytes_read)
+        for lines, count in list(self.traces.values())[:MAX_TRACES]:
+            text += "\n\n[x{0}] {1}".format(count, lines[0][:300])
+            for frame in lines[1:MAX_FRAMES + 1]:
+                text += "\n  " + frame[:200]
+            if len(lines) > MAX_FRAMES + 1:
+                text += "\n  ..."
+        return text
+
+
+async def analyze_log(session, url, byte_cap=LOG_BYTE_CAP):
+    summary = LogSummary()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = ""
+    async with session.get(url) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            if summary.bytes_read + len(chunk) > byte_cap:
+                chunk = chunk[:byte_cap - summary.bytes_read]
+                summary.truncated = True
+            summary.bytes_read += len(chunk)
+
+            lines = (pending + decoder.decode(chunk)).split('\n')
+            pending = lines.pop()[:MAX_LINE_LENGTH]
+            for line in lines:
+                summary.feedLine(line.rstrip('\r')[:MAX_LINE_LENGTH])
+            if summary.truncated:
+                break
+
+    if pending != "":
+        summary.feedLine(pending.rstrip('\r'))
+    summary.endTrace()
+    return summary
+
+
+class LogAnalyzer:
+    """
+    Runs log analyses in the background, a few at a time.
+    """
+    def __init__(self, byte_cap=LOG_BYTE_CAP, max_concurrent=MAX_CONCURRENT):
+        self.byte_cap = byte_cap
+        self.max_concurrent = max_concurrent
+        self.semaphore = None
+
+    async def analyze(self, session, url):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self.semaphore:
+            return await analyze_log(session, url, self.byte_cap)
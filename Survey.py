@@ -0,0 +1,134 @@
+import os
+import re
+
+
+# target of a transition that ends the survey
+DONE = "done"
+# event key for a reporter message with any text in it
+TEXT_KEY = "text"
+
+# what happens to the attachment that answered a step
+ACTION_LOG = "log"
+ACTION_MIRROR = "mirror"
+
+# step ids are read back from the prompt text, so they must be plain word characters
+STEP_ID = r"\w+"
+
+DEFAULT_SURVEY = {
+    "start": "1",
+    "complete": "Questionaire complete! You can continue to post information from here on if you have updates.",
+    "steps": {
+        "1": {
+            "text": "Is this a :beetle: Bug, :bulb: Feature Request, or :abc: Text Mistake?",
+            "reactions": ["\U0001FAB2", "\U0001F4A1", "\U0001F524"],
+            "next": { "\U0001FAB2": "2", "\U0001F4A1": DONE, "\U0001F524": DONE }
+        },
+        "2": {
+            "text": "Please attach the log file for this error.  Logs are found in the `LOG/` folder.  Attach the `.txt` file with the date that matches when you encountered the bug.\nIf this bug occurred outside of the game (such as with the updater), click :x:",
+            "reactions": ["\U0000274C"],
+            "next": { ".txt": "3", "\U0000274C": DONE },
+            "action": ACTION_LOG
+        },
+        "3": {
+            "text": "Was this bug was encountered in a dungeon adventure?",
+            "reactions": ["\U00002705", "\U0000274C"],
+            "next": { "\U00002705": "3a", "\U0000274C": "4" }
+        },
+        "3a": {
+            "text": "Did you :checkered_flag: finish that adventure, or are you still :flag_white: in the middle of it?",
+            "reactions": ["\U0001F3C1", "\U0001F3F3"],
+            "next": { "\U0001F3C1": "3b", "\U0001F3F3": "3c" }
+        },
+        "3b": {
+            "text": "Please attach a replay (`.rsrec`) of the adventure.\nCheck replays ingame at the Title Menu under Records, and find the files themselves in the `REPLAY/` folder.\nMake sure the error shows up in the replay.",
+            "reactions": [],
+            "next": { ".rsrec": DONE },
+            "action": ACTION_MIRROR
+        },
+        "3c": {
+            "text": "Please attach your quicksave file (`QUICKSAVE.rsqs`).  You can find it in the `SAVE/` folder.",
+            "reactions": [],
+            "next": { ".rsqs": DONE },
+            "action": ACTION_MIRROR
+        },
+        "4": {
+            "text": "Was this bug encountered while :video_game: Playing or :pencil: Editing the game?",
+            "reactions": ["\U0001F3AE", "\U0001F4DD"],
+            "next": { "\U0001F4DD": "4a", "\U0001F3AE": "5" }
+        },
+        "4a": {
+            "text": "Starting from when you open the game, can you list the exact steps to reproduce this issue?  :x: if this was already mentioned.",
+            "reactions": ["\U0000274C"],
+            "next": { TEXT_KEY: DONE, "\U0000274C": DONE }
+        },
+        "5": {
+            "text": "Please attach your save file.  You can find it in the `SAVE/` folder named `SAVE.rssv`",
+            "reactions": [],
+            "next": { ".rssv": "5a" },
+            "action": ACTION_MIRROR
+        },
+        "5a": {
+            "text": "Starting from when you load your save file, can you list the exact steps to reproduce this issue?  :x: if this was already mentioned.",
+            "reactions": ["\U0000274C"],
+            "next": { TEXT_KEY: DONE, "\U0000274C": DONE }
+        }
+    }
+}
+
+
+class CompiledSurvey:
+    """
+    A survey definition flattened into lookup tables: one dict access per (step, answer).
+    """
+    def __init__(self, definition):
+        self.start = definition["start"]
+        self.complete = definition["complete"]
+        self.prompts = {}
+        self.reactions = {}
+        # (step, event key) -> (next step or DONE, action or None)
+        self.transitions = {}
+
+        steps = definition["steps"]
+        for step in steps:
+            if re.fullmatch(STEP_ID, step) is None:
+                raise ValueError("Survey step id {0} may only contain letters, digits and underscores".format(step))
+            step_def = steps[step]
+            self.prompts[step] = step_def["text"]
+            self.reactions[step] = step_def.get("reactions", [])
+            for key in step_def["next"]:
+                target = step_def["next"][key]
+                if target != DONE and target not in steps:
+                    raise ValueError("Survey step {0} leads to unknown step {1}".format(step, target))
+                # actions only concern the attachment that answered the step
+                action = step_def.get("action") if key.startswith('.') else None
+                self.transitions[(step, key)] = (target, action)
+        if self.start not in steps:
+            raise ValueError("Survey starts at unknown step {0}".format(self.start))
+
+    def getPrompt(self, issue_reporter, step):
+        return "<@!{0}>\n{1}. {2}".format(issue_reporter, step, self.prompts[step])
+
+
+def message_keys(msg):
+    """
+    Event keys for a reporter's message: the first attachment's extension, then text if there is any.
+    """
+    keys = []
+    if len(msg.attachments) > 0:
+        _, ext = os.path.splitext(msg.attachments[0].filename)
+        keys.append(ext.lower())
+    if msg.content != "":
+        keys.append(TEXT_KEY)
+    return keys
+
+
+def advance(survey, step, keys):
+    """
+    Pure transition function: returns (next step or DONE, action or None) for the first key
+    that answers step, or None if none of them do.
+    """
+    for key in keys:
+        result = survey.transitions.get((step, key))
+        if result is not None:
+            return result
+    return None
@@ -0,0 +1,332 @@
+import asyncio
+import discord
+
+
+FIRST_ID = 100000000000000000
+
+
+class FakeNotFound(Exception):
+    pass
+
+
+class FakeRoute:
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+
+
+class FakeHTTP:
+    """
+    Stands in for discord.py's HTTPClient; every REST call the fakes make passes through request.
+    """
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = 0
+
+    async def request(self, route, **kwargs):
+        self.calls += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+
+class FakeUser:
+
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.discriminator = "0"
+        self.bot = bot
+
+    @property
+    def mention(self):
+        return "<@{0}>".format(self.id)
+
+
+class FakeGuild:
+
+    def __init__(self, guild_id, me):
+        self.id = guild_id
+        self.me = me
+
+
+class FakeAttachment:
+
+    def __init__(self, filename, url):
+        self.filename = filename
+        self.url = url
+
+
+class FakeReference:
+
+    def __init__(self, channel_id, message_id):
+        self.channel_id = channel_id
+        self.message_id = message_id
+
+
+class FakePayload:
+
+    def __init__(self, guild_id, channel_id, message_id, user=None, emoji=None):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.user_id = user.id if user is not None else None
+        self.member = user
+        self.emoji = emoji
+
+
+class FakeReaction:
+
+    def __init__(self, client, message, emoji, user_ids):
+        self.client = client
+        self.message = message
+        self.emoji = emoji
+        self.count = len(user_ids)
+        self.me = client.user.id in user_ids
+        self.user_ids = list(user_ids)
+
+    async def users(self):
+        await self.client.rest("GET", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}")
+        for user_id in self.user_ids:
+            yield self.client.users[user_id]
+
+
+class FakeMessage:
+
+    def __init__(self, client, channel, msg_id, author, content, attachments=None, reference=None):
+        self.client = client
+        self.channel = channel
+        self.id = msg_id
+        self.author = author
+        self.content = content
+        self.attachments = attachments or []
+        self.reference = reference
+        self.type = discord.MessageType.default
+        self.channel_mentions = []
+        # emoji -> user ids, in the order they reacted
+        self.reactors = {}
+        self.deleted = False
+
+    @property
+    def guild(self):
+        return self.channel.guild
+
+    @property
+    def mentions(self):
+        return [self.client.users[user_id] for user_id in self.client.mentionIds(self.content)]
+
+    @property
+    def reactions(self):
+        return [FakeReaction(self.client, self, emoji, self.reactors[emoji]) for emoji in self.reactors if len(self.reactors[emoji]) > 0]
+
+    async def add_reaction(self, emoji):
+        await self.client.rest("PUT", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me")
+        self.client.putReaction(self, self.client.user, str(emoji))
+
+    async def remove_reaction(self, emoji, member):
+        await self.client.rest("DELETE", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/{member_id}")
+        self.client.pullReaction(self, member, str(emoji))
+
+    async def delete(self):
+        await self.client.rest("DELETE", "/channels/{channel_id}/messages/{message_id}")
+        self.client.deleteMessage(self)
+
+    async def edit(self, content=None):
+        await self.client.rest("PATCH", "/channels/{channel_id}/messages/{message_id}")
+        if content is not None:
+            self.content = content
+        return self
+
+    async def create_thread(self, name):
+        await self.client.rest("POST", "/channels/{channel_id}/messages/{message_id}/threads")
+        # like Discord, a thread started from a message shares its id
+        return self.client.addThread(self.channel, self.id, name)
+
+
+class FakePartialMessage:
+
+    def __init__(self, channel, msg_id):
+        self.channel = channel
+        self.id = msg_id
+
+    async def add_reaction(self, emoji):
+        msg = self.channel.messages.get(self.id)
+        if msg is None:
+            raise FakeNotFound("Unknown Message")
+        await msg.add_reaction(emoji)
+
+    async def remove_reaction(self, emoji, member):
+        msg = self.channel.messages.get(self.id)
+        if msg is None:
+            raise FakeNotFound("Unknown Message")
+        await msg.remove_reaction(emoji, member)
+
+
+class FakeChannel:
+
+    def __init__(self, client, guild, channel_id, name):
+        self.client = client
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        # kept in id order, which is also posting order
+        self.messages = {}
+
+    async def send(self, content):
+        await self.client.rest("POST", "/channels/{channel_id}/messages")
+        return self.client.postMessage(self, self.client.user, content)
+
+    async def fetch_message(self, msg_id):
+        await self.client.rest("GET", "/channels/{channel_id}/messages/{message_id}")
+        msg = self.messages.get(msg_id)
+        if msg is None:
+            raise FakeNotFound("Unknown Message")
+        return msg
+
+    def get_partial_message(self, msg_id):
+        return FakePartialMessage(self, msg_id)
+
+    async def history(self, limit=100, before=None):
+        before_id = getattr(before, "id", before)
+        ids = [msg_id for msg_id in reversed(list(self.messages)) if before_id is None or msg_id < before_id]
+        # fetched a page of 100 at a time, like the real endpoint
+        for idx, msg_id in enumerate(ids):
+            if limit is not None and idx >= limit:
+                break
+            if idx % 100 == 0:
+                await self.client.rest("GET", "/channels/{channel_id}/messages")
+            yield self.messages[msg_id]
+
+
+class FakeThread(FakeChannel):
+
+    def __init__(self, client, parent, thread_id, name):
+        super().__init__(client, parent.guild, thread_id, name)
+        self.parent = parent
+        self.parent_id = parent.id
+
+
+class FakeClient:
+    """
+    In-process stand-in for discord.Client: it holds every guild, channel and message itself.
+    Simulated users act through post/react/unreact, which update that state and dispatch
+    the same gateway events the real client would.  REST calls only cost the configured latency.
+    """
+    def __init__(self, latency=0):
+        self.http = FakeHTTP(latency)
+        self.next_id = FIRST_ID
+        self.users = {}
+        self.channels = {}
+        self.events = {}
+        self.pending = set()
+        self.user = self.addUser("IssueBot", bot=True)
+
+    @property
+    def loop(self):
+        return asyncio.get_running_loop()
+
+    def event(self, coro):
+        self.events[coro.__name__] = coro
+        return coro
+
+    def newId(self):
+        self.next_id += 1
+        return self.next_id
+
+    def addUser(self, name, bot=False, user_id=None):
+        user = FakeUser(user_id if user_id is not None else self.newId(), name, bot)
+        self.users[user.id] = user
+        return user
+
+    def addGuild(self, guild_id):
+        return FakeGuild(guild_id, self.user)
+
+    def addChannel(self, guild, name, channel_id=None):
+        channel = FakeChannel(self, guild, channel_id if channel_id is not None else self.newId(), name)
+        self.channels[channel.id] = channel
+        return channel
+
+    def addThread(self, parent, thread_id, name):
+        thread = FakeThread(self, parent, thread_id, name)
+        self.channels[thread.id] = thread
+        return thread
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def fetch_user(self, user_id):
+        await self.rest("GET", "/users/{user_id}")
+        return self.users[user_id]
+
+    async def wait_until_ready(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def rest(self, method, path):
+        await self.http.request(FakeRoute(method, path))
+
+    def mentionIds(self, content):
+        ids = []
+        for word in content.replace('\n', ' ').split(' '):
+            if word.startswith("<@") and word.endswith(">"):
+                user_id = word.strip("<@!>")
+                if user_id.isdigit() and int(user_id) in self.users:
+                    ids.append(int(user_id))
+        return ids
+
+    def dispatch(self, name, *args):
+        handler = self.events.get(name)
+        if handler is None:
+            return None
+        task = asyncio.get_running_loop().create_task(handler(*args))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return task
+
+    async def drain(self):
+        # wait out every event handler, including those dispatched by other handlers
+        while len(self.pending) > 0:
+            await asyncio.gather(*list(self.pending), return_exceptions=True)
+
+    def addMessage(self, channel, author, content, attachments=None, reference=None):
+        # stored without any gateway event, as if posted while the bot was away
+        msg = FakeMessage(self, channel, self.newId(), author, content, attachments, reference)
+        channel.messages[msg.id] = msg
+        return msg
+
+    def postMessage(self, channel, author, content, attachments=None, reference=None):
+        msg = self.addMessage(channel, author, content, attachments, reference)
+        self.dispatch("on_message", msg)
+        return msg
+
+    def putReaction(self, msg, user, emoji):
+        users = msg.reactors.setdefault(emoji, [])
+        if user.id in users:
+            return None
+        users.append(user.id)
+        return self.dispatch("on_raw_reaction_add", FakePayload(msg.guild.id, msg.channel.id, msg.id, user, emoji))
+
+    def pullReaction(self, msg, user, emoji):
+        users = msg.reactors.get(emoji, [])
+        if user.id not in users:
+            return None
+        users.remove(user.id)
+        return self.dispatch("on_raw_reaction_remove", FakePayload(msg.guild.id, msg.channel.id, msg.id, user, emoji))
+
+    def deleteMessage(self, msg):
+        msg.channel.messages.pop(msg.id, None)
+        msg.deleted = True
+        return self.dispatch("on_raw_message_delete", FakePayload(msg.guild.id, msg.channel.id, msg.id))
+
+    # what a simulated user does; each returns the dispatched handler task to await if wanted
+    def post(self, channel, author, content, attachments=None, reference=None):
+        msg = self.addMessage(channel, author, content, attachments, reference)
+        return msg, self.dispatch("on_message", msg)
+
+    def react(self, msg, user, emoji):
+        return self.putReaction(msg, user, emoji)
+
+    def unreact(self, msg, user, emoji):
+        return self.pullReaction(msg, user, emoji)
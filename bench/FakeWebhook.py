@@ -0,0 +1,60 @@
+"""
+Sends a signed GitHub webhook delivery to the bot's receiver, for trying issue status sync locally.
+
+    python bench/FakeWebhook.py --secret s3cret --number 12 --action closed --reason not_planned
+    python bench/FakeWebhook.py --secret s3cret --event pull_request --number 40 --closes 12 --merged
+"""
+import os
+import sys
+import hmac
+import json
+import asyncio
+import hashlib
+import argparse
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IssueStatus
+
+
+def issuePayload(options):
+    issue = { "number": options.number, "title": "Issue {0}".format(options.number), "body": "",
+              "state": "closed" if options.action == "closed" else "open",
+              "state_reason": options.reason if options.action == "closed" else None,
+              "labels": [{ "name": label } for label in options.label],
+              "html_url": "https://github.com/owner/repo/issues/{0}".format(options.number) }
+    return { "action": options.action, "issue": issue }
+
+
+def pullPayload(options):
+    pull = { "number": options.number, "title": "Pull {0}".format(options.number),
+             "body": " ".join("Fixes #{0}".format(number) for number in options.closes),
+             "state": "closed" if options.merged or options.action == "closed" else "open",
+             "merged_at": "2024-01-01T00:00:00Z" if options.merged else None,
+             "html_url": "https://github.com/owner/repo/pull/{0}".format(options.number) }
+    return { "action": options.action, "pull_request": pull }
+
+
+async def send(options):
+    payload = issuePayload(options) if options.event == "issues" else pullPayload(options)
+    body = json.dumps(payload).encode()
+    signature = "sha256=" + hmac.new(options.secret.encode(), body, hashlib.sha256).hexdigest()
+    headers = { "X-GitHub-Event": options.event, "X-Hub-Signature-256": signature, "Content-Type": "application/json" }
+    async with aiohttp.ClientSession() as session:
+        async with session.post(options.url, data=body, headers=headers) as resp:
+            print(resp.status)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a signed GitHub webhook delivery")
+    parser.add_argument("--url", default="http://127.0.0.1:8080" + IssueStatus.WEBHOOK_PATH)
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--event", default="issues", choices=["issues", "pull_request"])
+    parser.add_argument("--action", default="closed")
+    parser.add_argument("--number", type=int, required=True)
+    parser.add_argument("--reason", default="completed", help="state_reason of a closed issue")
+    parser.add_argument("--label", action="append", default=[], help="label the issue has; repeatable")
+    parser.add_argument("--closes", type=int, action="append", default=[], help="issue a pull request closes; repeatable")
+    parser.add_argument("--merged", action="store_true")
+    asyncio.run(send(parser.parse_args()))
@@ -0,0 +1,119 @@
+import json
+import time
+import asyncio
+import hashlib
+from aiohttp import web
+
+
+STUB_HOST = '127.0.0.1'
+RATE_LIMIT = 5000
+LABELS = ["bug", "enhancement", "text"]
+
+
+class GithubStub:
+    """
+    Local HTTP stand-in for the parts of the GitHub API the bot uses:
+    installation tokens, REST issues (with ETag/304 listing), labels, GraphQL issue creation,
+    and /files/ for attachments such as logs.  Rate-limit headers are sent on every API response.
+    """
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.issues = []
+        self.files = {}
+        self.rate_remaining = RATE_LIMIT
+        self.requests = 0
+        self.runner = None
+        self.url = None
+
+    def addFile(self, name, data):
+        self.files[name] = data
+        return "{0}/files/{1}".format(self.url, name)
+
+    def newIssue(self, title, body, labels):
+        number = len(self.issues) + 1
+        issue = { "number": number, "title": title, "body": body, "state": "open",
+                  "labels": [{ "name": label } for label in labels],
+                  "html_url": "https://github.com/owner/repo/issues/{0}".format(number),
+                  "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()) }
+        self.issues.append(issue)
+        return issue
+
+    def headers(self):
+        self.rate_remaining = max(self.rate_remaining - 1, 0)
+        return { "X-RateLimit-Remaining": str(self.rate_remaining),
+                 "X-RateLimit-Reset": str(int(time.time()) + 3600) }
+
+    async def respond(self, data, status=200, headers=None):
+        self.requests += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        all_headers = self.headers()
+        if headers is not None:
+            all_headers.update(headers)
+        if data is None:
+            return web.Response(status=status, headers=all_headers)
+        return web.json_response(data, status=status, headers=all_headers)
+
+    async def accessToken(self, request):
+        expires = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600))
+        return await self.respond({ "token": "stub-token", "expires_at": expires }, 201)
+
+    async def createIssue(self, request):
+        issue_json = await request.json()
+        issue = self.newIssue(issue_json["title"], issue_json.get("body", ""), issue_json.get("labels", []))
+        return await self.respond(issue, 201)
+
+    async def listIssues(self, request):
+        since = request.query.get("since")
+        issues = [issue for issue in self.issues if since is None or issue["updated_at"] >= since]
+        etag = '"{0}"'.format(hashlib.sha1(json.dumps(issues).encode()).hexdigest())
+        if request.headers.get("If-None-Match") == etag:
+            return await self.respond(None, 304, { "ETag": etag })
+        return await self.respond(issues, 200, { "ETag": etag })
+
+    async def addLabels(self, request):
+        issue = self.issues[int(request.match_info["number"]) - 1]
+        for label in await request.json():
+            issue["labels"].append({ "name": label })
+        return await self.respond(issue["labels"])
+
+    async def graphql(self, request):
+        request_json = await request.json()
+        variables = request_json.get("variables", {})
+        if "repository(" in request_json["query"]:
+            labels = [{ "id": "L_" + label, "name": label } for label in LABELS]
+            return await self.respond({ "data": { "repository": { "id": "R_stub", "labels": { "nodes": labels } } } })
+
+        data = {}
+        for key in variables:
+            issue_input = variables[key]
+            labels = [label_id[len("L_"):] for label_id in issue_input.get("labelIds", [])]
+            issue = self.newIssue(issue_input["title"], issue_input.get("body", ""), labels)
+            data["i" + key[len("in"):]] = { "issue": { "number": issue["number"], "url": issue["html_url"] } }
+        return await self.respond({ "data": data })
+
+    async def getFile(self, request):
+        data = self.files.get(request.match_info["name"])
+        if data is None:
+            return web.Response(status=404)
+        return web.Response(body=data)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/app/installations/{install_id}/access_tokens', self.accessToken)
+        app.router.add_post('/repos/{owner}/{repo}/issues', self.createIssue)
+        app.router.add_get('/repos/{owner}/{repo}/issues', self.listIssues)
+        app.router.add_post('/repos/{owner}/{repo}/issues/{number}/labels', self.addLabels)
+        app.router.add_post('/graphql', self.graphql)
+        app.router.add_get('/files/{name}', self.getFile)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, STUB_HOST, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = "http://{0}:{1}".format(STUB_HOST, port)
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
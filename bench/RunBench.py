@@ -0,0 +1,333 @@
+"""
+Load tests IssueBot against an in-process fake Discord and a local GitHub stand-in.
+
+    python bench/RunBench.py                          # every synthetic scenario
+    python bench/RunBench.py --scenario surveys --surveys 2000 --latency-ms 50
+    python bench/RunBench.py --scenario replay --replay events.jsonl --config config.json
+
+Recordings come from a live bot with "record_path" set in its config.json.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import IssueBot
+import EventLog
+from FakeDiscord import FakeClient, FakeAttachment, FakeReference
+from GithubStub import GithubStub
+
+
+GUILD_ID = 1
+EVENTS = ["on_message", "on_raw_reaction_add", "on_raw_reaction_remove", "on_raw_reaction_clear",
+          "on_raw_reaction_clear_emoji", "on_raw_message_delete"]
+SCENARIOS = ["surveys", "unresolved", "push", "bulk"]
+
+LOG_TEXT = "RogueEssence 0.7.0\n" + "[12:00:00] loading...\n" * 2000 + \
+    "[12:00:01] System.NullReferenceException: Object reference not set to an instance of an object.\n" + \
+    "   at RogueEssence.Dungeon.DungeonScene.Update(FrameTick elapsed)\n   at RogueEssence.GameBase.Update(GameTime gameTime)\n"
+
+BUG_EMOJI = "\U0001FAB2"
+YES_EMOJI = "\U00002705"
+FINISHED_EMOJI = "\U0001F3C1"
+RESOLVED_EMOJI = "\U0001F44D"
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Bench:
+    """
+    One bot instance wired to the fakes; each scenario runs against a fresh one.
+    """
+    def __init__(self, options):
+        self.options = options
+        self.latency = options.latency_ms / 1000
+
+    async def setUp(self, servers=None, root=None):
+        self.path = tempfile.mkdtemp(prefix="issuebot-bench-")
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        with open(os.path.join(self.path, IssueBot.PRIVATE_KEY_FILE_PATH), 'wb') as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                      serialization.NoEncryption()))
+
+        self.github = GithubStub(self.latency)
+        api_url = await self.github.start()
+
+        self.client = FakeClient(self.latency)
+        self.root = self.client.addUser("root", user_id=root)
+        guild = self.client.addGuild(GUILD_ID)
+        self.issue_ch = self.client.addChannel(guild, "bug-reports")
+        self.chat_ch = self.client.addChannel(guild, "bot-chat")
+        if servers is None:
+            servers = { str(GUILD_ID): { "issue": self.issue_ch.id, "chat": self.chat_ch.id, "prefix": "!" } }
+
+        config = { "root": self.root.id, "error_ch": self.chat_ch.id, "repo_owner": "owner", "repo_name": "repo",
+                   "api_url": api_url, "app_id": "1", "install_id": "1", "servers": servers }
+        if self.options.sqlite:
+            config["db_path"] = "bench.db"
+        with open(os.path.join(self.path, IssueBot.CONFIG_FILE_PATH), 'w') as f:
+            json.dump(config, f)
+
+        # the module-level event handlers use these globals
+        IssueBot.client = self.client
+        self.bot = IssueBot.IssueBot(self.path, self.client)
+        IssueBot.issue_bot = self.bot
+        for name in EVENTS:
+            self.client.event(getattr(IssueBot, name))
+        self.bot.startBackgroundTasks()
+        self.samples = {}
+
+    async def tearDown(self):
+        await self.settle()
+        self.bot.flushConfig()
+        await self.bot.github.close()
+        if self.bot.downloads is not None:
+            await self.bot.downloads.close()
+        if self.bot.db is not None:
+            self.bot.db.close()
+        await self.github.stop()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    async def timed(self, name, task):
+        # latency of one dispatched handler, from the gateway event to the handler returning
+        start = time.perf_counter()
+        if task is not None:
+            await task
+        self.samples.setdefault(name, []).append(time.perf_counter() - start)
+
+    async def settle(self):
+        # event handlers start background work, and that work can dispatch more events
+        while len(self.client.pending) > 0 or len(self.bot.background) > 0:
+            await self.client.drain()
+            results = await asyncio.gather(*list(self.bot.background), return_exceptions=True)
+            for result in results:
+                # the bot reports its own errors; anything that escaped it still counts
+                if isinstance(result, BaseException):
+                    traceback.print_exception(type(result), result, result.__traceback__)
+                    self.bot.stats.observe("errors", 0, True)
+
+    async def report(self, title, count, elapsed):
+        await self.settle()
+        print("== {0}: {1} events in {2:.2f}s, {3:.0f}/s".format(title, count, elapsed, count / elapsed if elapsed > 0 else 0))
+        for name in sorted(self.samples):
+            samples = self.samples[name]
+            print("  {0:<24} n={1:<6} p50={2:8.2f}ms p99={3:8.2f}ms max={4:8.2f}ms".format(
+                name, len(samples), 1000 * percentile(samples, 0.5), 1000 * percentile(samples, 0.99), 1000 * max(samples)))
+        errors = self.bot.stats.ops.get("errors")
+        print("  errors: {0}  discord calls: {1}  github calls: {2}".format(
+            errors.count if errors is not None else 0, self.client.http.calls, self.github.requests))
+        if self.options.verbose:
+            print(self.bot.stats.getText())
+
+    async def waitFor(self, condition, timeout=60):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                raise TimeoutError("gave up waiting for the bot")
+            await asyncio.sleep(0.01)
+
+    def latestPrompt(self, thread):
+        return self.bot.config.servers[str(GUILD_ID)].threads[str(thread.id)].prompt
+
+    async def runSurvey(self, reporter, log_url, idx):
+        report, task = self.client.post(self.issue_ch, reporter, "Crash in dungeon {0}\nIt froze after a fight.".format(idx))
+        await self.timed("report", task)
+        thread = self.client.get_channel(report.id)
+
+        answers = [BUG_EMOJI, FakeAttachment("log.txt", log_url), YES_EMOJI, FINISHED_EMOJI,
+                   FakeAttachment("run.rsrec", log_url)]
+        for answer in answers:
+            if isinstance(answer, FakeAttachment):
+                msg, task = self.client.post(thread, reporter, "", [answer])
+                await self.timed("answer attachment", task)
+            else:
+                prompt = thread.messages[self.latestPrompt(thread)]
+                await self.timed("answer reaction", self.client.react(prompt, reporter, answer))
+
+    async def surveys(self):
+        log_url = self.github.addFile("log.txt", LOG_TEXT.encode())
+        reporters = [self.client.addUser("reporter{0}".format(idx)) for idx in range(self.options.surveys)]
+        start = time.perf_counter()
+        await asyncio.gather(*[self.runSurvey(reporter, log_url, idx) for idx, reporter in enumerate(reporters)])
+        await self.client.drain()
+        elapsed = time.perf_counter() - start
+        await self.report("{0} concurrent surveys".format(len(reporters)), sum(len(s) for s in self.samples.values()), elapsed)
+
+    async def unresolved(self):
+        server = self.bot.config.servers[str(GUILD_ID)]
+        # let the startup rescan finish first so it doesn't overlap with the timed one
+        await self.waitFor(lambda: server.unresolved_synced)
+        reporter = self.client.addUser("reporter")
+        for idx in range(self.options.messages):
+            msg = self.client.addMessage(self.issue_ch, reporter, "report {0}".format(idx))
+            if idx % 3 == 0:
+                msg.reactors[RESOLVED_EMOJI] = [self.root.id]
+            elif idx % 3 == 1:
+                msg.reactors[BUG_EMOJI] = [self.client.user.id]
+        # as if they were posted while the bot was down
+        server.unresolved_synced = False
+
+        start = time.perf_counter()
+        msg, task = self.client.post(self.chat_ch, self.root, "!unresolved")
+        await self.timed("unresolved (rescan)", task)
+        msg, task = self.client.post(self.chat_ch, self.root, "!unresolved")
+        await self.timed("unresolved (index)", task)
+        elapsed = time.perf_counter() - start
+        await self.report("unresolved over {0} messages".format(self.options.messages), 2, elapsed)
+
+    async def postReports(self, count):
+        reporter = self.client.addUser("reporter")
+        reports = []
+        for idx in range(count):
+            report, task = self.client.post(self.issue_ch, reporter, "Report {0}\nsomething broke".format(idx))
+            reports.append(report)
+        await self.client.drain()
+        self.samples = {}
+        return reports
+
+    async def push(self):
+        reports = await self.postReports(self.options.bulk)
+        server = self.bot.config.servers[str(GUILD_ID)]
+        start = time.perf_counter()
+        await asyncio.gather(*[self.timed("push command", self.client.post(self.issue_ch, self.root, "!bug Report {0}".format(idx),
+                                                                           reference=FakeReference(self.issue_ch.id, report.id))[1])
+                               for idx, report in enumerate(reports)])
+        await self.waitFor(lambda: all(server.issues.get(str(report.id), {}).get("number") is not None for report in reports))
+        elapsed = time.perf_counter() - start
+        self.samples["pushed to github"] = [elapsed]
+        await self.report("{0} single pushes".format(len(reports)), len(reports), elapsed)
+
+    async def bulk(self):
+        reports = await self.postReports(self.options.bulk)
+        start = time.perf_counter()
+        msg, task = self.client.post(self.chat_ch, self.root, "!bulk bug " + " ".join(str(report.id) for report in reports))
+        await self.timed("bulk command", task)
+        elapsed = time.perf_counter() - start
+        await self.report("bulk push of {0}".format(len(reports)), len(reports), elapsed)
+
+    async def replay(self, path):
+        """
+        Replays a recording at full speed, one event after another.  Channels, threads and users are made up
+        from the ids seen; the bot's own messages in the recording are matched to the ones it posts here.
+        """
+        guilds = {}
+        bot_posts = {}
+        message_ids = {}
+        start = time.perf_counter()
+        count = 0
+        for event in EventLog.readEvents(path):
+            name = event["event"]
+            channel = self.replayChannel(guilds, message_ids, event)
+            if channel is None:
+                continue
+            if name == "on_message":
+                if event["bot"]:
+                    # map the recorded id onto the next message the bot posted in that channel
+                    posted = [msg_id for msg_id in channel.messages if channel.messages[msg_id].author.id == self.client.user.id
+                              and msg_id not in bot_posts.get(channel.id, set())]
+                    if len(posted) > 0:
+                        bot_posts.setdefault(channel.id, set()).add(posted[0])
+                        message_ids[event["id"]] = posted[0]
+                        continue
+                author = self.replayUser(event["author"], event["bot"])
+                attachments = [FakeAttachment(attachment["filename"], attachment["url"]) for attachment in event["attachments"]]
+                reference = None
+                if event["reference"] is not None:
+                    reference = FakeReference(event["reference"][0], message_ids.get(event["reference"][1], event["reference"][1]))
+                msg, task = self.client.post(channel, author, event["content"], attachments, reference)
+                message_ids[event["id"]] = msg.id
+            else:
+                msg = channel.messages.get(message_ids.get(event["message"], event["message"]))
+                if msg is None:
+                    continue
+                if name == "on_raw_reaction_add":
+                    task = self.client.react(msg, self.replayUser(event["user"], False), event["emoji"])
+                elif name == "on_raw_reaction_remove":
+                    task = self.client.unreact(msg, self.replayUser(event["user"], False), event["emoji"])
+                elif name == "on_raw_message_delete":
+                    task = self.client.deleteMessage(msg)
+                else:
+                    continue
+            await self.timed(name, task)
+            await self.client.drain()
+            count += 1
+        elapsed = time.perf_counter() - start
+        await self.report("replay of {0}".format(path), count, elapsed)
+
+    def replayUser(self, user_id, bot):
+        user = self.client.users.get(user_id)
+        if user is None:
+            user = self.client.addUser("user{0}".format(user_id), bot, user_id)
+        return user
+
+    def replayChannel(self, guilds, message_ids, event):
+        # threads share their id with the report they were opened from, which was posted here under a new id
+        channel = self.client.get_channel(message_ids.get(event["channel"], event["channel"]))
+        if channel is not None:
+            return channel
+        if event.get("parent") is not None:
+            parent = self.client.get_channel(event["parent"])
+            if parent is None:
+                return None
+            return self.client.addThread(parent, event["channel"], "thread")
+        guild = guilds.get(event["guild"])
+        if guild is None:
+            guild = self.client.addGuild(event["guild"])
+            guilds[event["guild"]] = guild
+        return self.client.addChannel(guild, "channel", event["channel"])
+
+
+async def runScenario(options, name):
+    bench = Bench(options)
+    if name == "replay":
+        with open(options.config) as f:
+            recorded = json.load(f)
+        # the recorded servers' channels are made up as events reach them
+        await bench.setUp(recorded["servers"], recorded["root"])
+    else:
+        await bench.setUp()
+    try:
+        if name == "replay":
+            await bench.replay(options.replay)
+        else:
+            await getattr(bench, name)()
+    except Exception:
+        print(traceback.format_exc())
+    finally:
+        await bench.tearDown()
+
+
+async def main(options):
+    names = SCENARIOS if options.scenario == "all" else [options.scenario]
+    for name in names:
+        await runScenario(options, name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IssueBot load benchmarks")
+    parser.add_argument("--scenario", default="all", choices=["all", "replay"] + SCENARIOS)
+    parser.add_argument("--surveys", type=int, default=500, help="concurrent surveys to run")
+    parser.add_argument("--messages", type=int, default=10000, help="messages in the issue channel for unresolved")
+    parser.add_argument("--bulk", type=int, default=30, help="reports per push scenario")
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated Discord and GitHub round trip")
+    parser.add_argument("--sqlite", action="store_true", help="keep servers in SQLite instead of config.json")
+    parser.add_argument("--replay", help="JSONL recording to replay")
+    parser.add_argument("--config", help="config.json the recording was made with, for its servers and root")
+    parser.add_argument("--verbose", action="store_true", help="also print the bot's own stats")
+    options = parser.parse_args()
+    if options.scenario == "replay" and (options.replay is None or options.config is None):
+        parser.error("replay needs --replay and --config")
+    asyncio.run(main(options))